@@ -0,0 +1,403 @@
+#!/usr/bin/env python3
+# 离线端到端吞吐量测试：启动 fake_mysql_server 回放 binlog 文件，运行 reverse_sql 的 main()，统计耗时与吞吐量。
+# 不指定 --binlog-dir 时会先生成一组合成的 binlog 文件（含多次文件轮转）。
+import argparse
+import contextlib
+import importlib
+import io
+import json
+import os
+import re
+import struct
+import sys
+import tempfile
+import time
+import zlib
+
+from fake_mysql_server import FakeMySQLServer, read_events
+
+ROTATE_EVENT = 0x04
+FORMAT_DESCRIPTION_EVENT = 0x0f
+TABLE_MAP_EVENT = 0x13
+WRITE_ROWS_EVENT_V1 = 0x17
+UPDATE_ROWS_EVENT_V1 = 0x18
+DELETE_ROWS_EVENT_V1 = 0x19
+WRITE_ROWS_EVENT_V2 = 0x1e
+UPDATE_ROWS_EVENT_V2 = 0x1f
+DELETE_ROWS_EVENT_V2 = 0x20
+ROWS_EVENTS = (WRITE_ROWS_EVENT_V1, UPDATE_ROWS_EVENT_V1, DELETE_ROWS_EVENT_V1,
+               WRITE_ROWS_EVENT_V2, UPDATE_ROWS_EVENT_V2, DELETE_ROWS_EVENT_V2)
+STMT_END_F = 0x0001
+
+# MySQL 8.0 FDE 中各事件类型的 post-header 长度（下标为事件类型-1）
+POST_HEADER_LENS = [0] * 41
+POST_HEADER_LENS[1] = 13          # QUERY_EVENT
+POST_HEADER_LENS[3] = 8           # ROTATE_EVENT
+POST_HEADER_LENS[14] = 98         # FORMAT_DESCRIPTION_EVENT
+POST_HEADER_LENS[18] = 8          # TABLE_MAP_EVENT
+POST_HEADER_LENS[22:25] = [8, 8, 8]     # WRITE/UPDATE/DELETE_ROWS_EVENT_V1
+POST_HEADER_LENS[29:32] = [10, 10, 10]  # WRITE/UPDATE/DELETE_ROWS_EVENT_V2
+
+# 合成表结构：id BIGINT PRIMARY KEY, amount INT, name VARCHAR(64)
+FIXTURE_COLUMNS = (("id", 8), ("amount", 3), ("name", 15))
+FIXTURE_TABLE_ID = 100
+
+# 第二张合成表覆盖常见的列类型，每 10 行在同一个语句中附带一行（TableMap(t1) TableMap(t2) Rows(t1) Rows(t2)），
+# 按行号轮流置 NULL，交替使用 v1/v2 行事件，更新使用 MINIMAL 格式的镜像，用于检查统计模式按列类型跳过行数据的逻辑。
+# (列名, 列类型, TableMap 中的列元数据)
+TYPED_COLUMNS = (
+    ("id", 8, b''),
+    ("c_tiny", 1, b''),
+    ("c_short", 2, b''),
+    ("c_int24", 9, b''),
+    ("c_float", 4, b'\x04'),
+    ("c_double", 5, b'\x08'),
+    ("c_dec1", 246, bytes([10, 2])),        # DECIMAL(10,2)
+    ("c_dec2", 246, bytes([20, 6])),        # DECIMAL(20,6)
+    ("c_varchar", 15, struct.pack('<H', 1200)),  # VARCHAR(300) utf8mb4，长度前缀为 2 个字节
+    ("c_char", 254, bytes([0xee, 0x90])),   # CHAR(100) utf8mb4，最大长度 400 的高位编码在类型字节中
+    ("c_enum", 254, bytes([247, 1])),
+    ("c_set", 254, bytes([248, 1])),
+    ("c_blob", 252, b'\x02'),
+    ("c_json", 245, b'\x04'),
+    ("c_geometry", 255, b'\x04'),
+    ("c_date", 10, b''),
+    ("c_time2", 19, b'\x03'),
+    ("c_datetime2", 18, b'\x06'),
+    ("c_timestamp2", 17, b'\x00'),
+    ("c_timestamp", 7, b''),
+    ("c_year", 13, b''),
+    ("c_bit", 16, bytes([2, 1])),           # BIT(10)
+)
+TYPED_TABLE_ID = 101
+TYPED_EVERY = 10
+DIG2BYTES = (0, 1, 1, 2, 2, 3, 3, 4, 4, 4)
+
+
+def lenenc_int(n):
+    if n < 251:
+        return bytes([n])
+    return b'\xfc' + struct.pack('<H', n)
+
+
+def pack_event(ts, event_type, body, pos):
+    # 生成带 CRC32 校验的 binlog 事件，返回 (事件字节, 下一个事件位置)
+    size = 19 + len(body) + 4
+    event = struct.pack('<IBIIIH', ts, event_type, 1, size, pos + size, 0) + body
+    event += struct.pack('<I', zlib.crc32(event) & 0xffffffff)
+    return event, pos + size
+
+
+def fde_body(ts):
+    return (struct.pack('<H', 4) + b'8.0.36'.ljust(50, b'\x00') + struct.pack('<I', ts) +
+            bytes([19]) + bytes(POST_HEADER_LENS) + b'\x01')
+
+
+def table_map_body(schema, table):
+    names = b''.join(lenenc_int(len(name)) + name.encode() for name, _ in FIXTURE_COLUMNS)
+    optional_metadata = (
+        bytes([2]) + lenenc_int(1) + lenenc_int(45) +                  # DEFAULT_CHARSET utf8mb4_general_ci
+        bytes([8]) + lenenc_int(1) + lenenc_int(0) +                   # SIMPLE_PRIMARY_KEY (id)
+        bytes([4]) + lenenc_int(len(names)) + names                    # COLUMN_NAME
+    )
+    return (struct.pack('<Q', FIXTURE_TABLE_ID)[:6] + struct.pack('<H', 1) +
+            bytes([len(schema)]) + schema.encode() + b'\x00' +
+            bytes([len(table)]) + table.encode() + b'\x00' +
+            lenenc_int(len(FIXTURE_COLUMNS)) + bytes(t for _, t in FIXTURE_COLUMNS) +
+            lenenc_int(2) + struct.pack('<H', 64) +
+            bytes([0b110]) + optional_metadata)
+
+
+def typed_table_map_body(schema, table):
+    names = b''.join(lenenc_int(len(name)) + name.encode() for name, _, _ in TYPED_COLUMNS)
+    enum_values = lenenc_int(3) + b''.join(lenenc_int(1) + v for v in (b'a', b'b', b'c'))
+    set_values = lenenc_int(3) + b''.join(lenenc_int(1) + v for v in (b'x', b'y', b'z'))
+    optional_metadata = (
+        bytes([2]) + lenenc_int(1) + lenenc_int(45) +                  # DEFAULT_CHARSET utf8mb4_general_ci
+        bytes([10]) + lenenc_int(1) + lenenc_int(45) +                 # ENUM_AND_SET_DEFAULT_CHARSET
+        bytes([6]) + lenenc_int(len(enum_values)) + enum_values +      # ENUM_STR_VALUE
+        bytes([5]) + lenenc_int(len(set_values)) + set_values +        # SET_STR_VALUE
+        bytes([8]) + lenenc_int(1) + lenenc_int(0) +                   # SIMPLE_PRIMARY_KEY (id)
+        bytes([4]) + lenenc_int(len(names)) + names                    # COLUMN_NAME
+    )
+    metadata = b''.join(meta for _, _, meta in TYPED_COLUMNS)
+    # 除 id 外的列都可以为 NULL
+    nullable = column_bitmap(range(1, len(TYPED_COLUMNS)), len(TYPED_COLUMNS))
+    return (struct.pack('<Q', TYPED_TABLE_ID)[:6] + struct.pack('<H', 1) +
+            bytes([len(schema)]) + schema.encode() + b'\x00' +
+            bytes([len(table)]) + table.encode() + b'\x00' +
+            lenenc_int(len(TYPED_COLUMNS)) + bytes(t for _, t, _ in TYPED_COLUMNS) +
+            lenenc_int(len(metadata)) + metadata + nullable + optional_metadata)
+
+
+def column_bitmap(columns, count):
+    bitmap = bytearray((count + 7) // 8)
+    for i in columns:
+        bitmap[i >> 3] |= 1 << (i & 7)
+    return bytes(bitmap)
+
+
+def decimal_bytes(integer, fraction, precision, scale):
+    # DECIMAL 的二进制格式：整数、小数部分按 9 位一组大端存储，不足 9 位的部分按位数压缩，首字节最高位为符号位
+    full, lead = divmod(precision - scale, 9)
+    value = (integer // 10 ** (9 * full)).to_bytes(DIG2BYTES[lead], 'big') if lead else b''
+    for i in reversed(range(full)):
+        value += (integer // 10 ** (9 * i) % 10 ** 9).to_bytes(4, 'big')
+    full, trail = divmod(scale, 9)
+    for i in range(full):
+        value += (fraction // 10 ** (scale - 9 * (i + 1)) % 10 ** 9).to_bytes(4, 'big')
+    if trail:
+        value += (fraction % 10 ** trail).to_bytes(DIG2BYTES[trail], 'big')
+    return bytes([value[0] ^ 0x80]) + value[1:]
+
+
+def typed_values(key):
+    # 按 TYPED_COLUMNS 的顺序返回各列的二进制值
+    text = f"row{key}".encode()
+    wide = ("宽" * (key % 7 + 1)).encode() + text * 30    # 超过 255 个字节，使用 2 字节长度前缀
+    ts = 1704074400 + key
+    hour, minute, second = key % 24, key % 60, (key * 7) % 60
+    ymd = ((2024 * 13 + 1) << 5) | (key % 28 + 1)
+    return [
+        struct.pack('<q', key),
+        struct.pack('<b', -(key % 100)),
+        struct.pack('<h', key % 30000),
+        (key % 8000000).to_bytes(3, 'little'),
+        struct.pack('<f', key / 4),
+        struct.pack('<d', key / 3),
+        decimal_bytes(key % 100000, 45, 10, 2),
+        decimal_bytes(key * 1000003, 123456, 20, 6),
+        struct.pack('<H', len(wide)) + wide,
+        struct.pack('<H', len(text)) + text,
+        bytes([key % 3 + 1]),
+        bytes([key % 8]),
+        struct.pack('<H', len(text)) + text,
+        struct.pack('<I', 2 + len(text)) + b'\x0c' + bytes([len(text)]) + text,
+        struct.pack('<I', 25) + b'\x00' * 4 + b'\x01\x01\x00\x00\x00' + struct.pack('<dd', key, -key),
+        ((2024 << 9) | (3 << 5) | (key % 28 + 1)).to_bytes(3, 'little'),
+        (0x800000 | hour << 12 | minute << 6 | second).to_bytes(3, 'big') + (key % 1000 * 10).to_bytes(2, 'big'),
+        (0x8000000000 | ymd << 17 | hour << 12 | minute << 6 | second).to_bytes(5, 'big') + (key % 1000000).to_bytes(3, 'big'),
+        struct.pack('>I', ts),
+        struct.pack('<I', ts),
+        bytes([124]),
+        (key % 1024).to_bytes(2, 'big'),
+    ]
+
+
+def typed_image(key, columns):
+    # columns 为镜像中出现的列下标；NULL 位图只覆盖出现的列，每行轮流有不同的列为 NULL
+    values = typed_values(key)
+    nulls = [i for i, column in enumerate(columns) if column and (key + column) % 4 == 0]
+    return (column_bitmap(nulls, len(columns)) +
+            b''.join(values[column] for i, column in enumerate(columns) if i not in nulls))
+
+
+def typed_rows_event(ts, key, pos):
+    # 按 insert(2行) -> update -> delete 循环，偶数轮使用 v2 行事件，奇数轮使用 v1 行事件；返回 (事件字节, 下一个事件位置, 行数)
+    op = key % 3
+    v1 = key // 3 % 2
+    all_columns = range(len(TYPED_COLUMNS))
+    bitmap = column_bitmap(all_columns, len(TYPED_COLUMNS))
+    header = struct.pack('<Q', TYPED_TABLE_ID)[:6] + struct.pack('<H', STMT_END_F) + (b'' if v1 else struct.pack('<H', 2))
+    if op == 0:
+        event_type = WRITE_ROWS_EVENT_V1 if v1 else WRITE_ROWS_EVENT_V2
+        images, rows = typed_image(key, all_columns) + typed_image(key + 1, all_columns), 2
+        body = header + lenenc_int(len(TYPED_COLUMNS)) + bitmap + images
+    elif op == 1:
+        # MINIMAL 格式：更新前镜像只有主键，更新后镜像只有被修改的列
+        event_type = UPDATE_ROWS_EVENT_V1 if v1 else UPDATE_ROWS_EVENT_V2
+        changed = [i for i in all_columns if i % 3 == key % 3 or i == 8]
+        images, rows = typed_image(key, [0]) + typed_image(key + 1, changed), 1
+        body = (header + lenenc_int(len(TYPED_COLUMNS)) + column_bitmap([0], len(TYPED_COLUMNS)) +
+                column_bitmap(changed, len(TYPED_COLUMNS)) + images)
+    else:
+        event_type = DELETE_ROWS_EVENT_V1 if v1 else DELETE_ROWS_EVENT_V2
+        images, rows = typed_image(key, all_columns), 1
+        body = header + lenenc_int(len(TYPED_COLUMNS)) + bitmap + images
+    event, pos = pack_event(ts, event_type, body, pos)
+    return event, pos, rows
+
+
+def row_image(row_id, amount, name):
+    name = name.encode()
+    return b'\x00' + struct.pack('<qi', row_id, amount) + bytes([len(name)]) + name
+
+
+def rows_body(images, update=False):
+    bitmap = bytes([0b111])
+    return (struct.pack('<Q', FIXTURE_TABLE_ID)[:6] + struct.pack('<HH', STMT_END_F, 2) +
+            lenenc_int(len(FIXTURE_COLUMNS)) + bitmap + (bitmap if update else b'') + b''.join(images))
+
+
+def write_fixture_binlogs(binlog_dir, files=3, rows=30000, start_ts=None, schema="hcy", table="t1", typed_table="t2"):
+    # 按 insert -> update -> delete 循环生成行事件，每秒 100 行，均匀分布在各个 binlog 文件中；
+    # 每 TYPED_EVERY 行在同一语句中附带一行 typed_table 的变更。返回两张表实际生成的总行数
+    if start_ts is None:
+        start_ts = int(time.mktime((2024, 1, 1, 10, 0, 0, 0, 0, -1)))
+    rows_per_file = rows // files
+    row_id = 0
+    typed_rows = 0
+    for n in range(1, files + 1):
+        name = f"mysql-bin.{n:06d}"
+        with open(os.path.join(binlog_dir, name), 'wb') as f:
+            f.write(b'\xfebin')
+            ts = start_ts + row_id // 100
+            event, pos = pack_event(ts, FORMAT_DESCRIPTION_EVENT, fde_body(ts), 4)
+            f.write(event)
+            for _ in range(rows_per_file):
+                ts = start_ts + row_id // 100
+                event, pos = pack_event(ts, TABLE_MAP_EVENT, table_map_body(schema, table), pos)
+                f.write(event)
+                with_typed = row_id % TYPED_EVERY == 0
+                if with_typed:
+                    event, pos = pack_event(ts, TABLE_MAP_EVENT, typed_table_map_body(schema, typed_table), pos)
+                    f.write(event)
+                op = row_id % 3
+                key = row_id // 3
+                if op == 0:
+                    event, pos = pack_event(ts, WRITE_ROWS_EVENT_V2,
+                                            rows_body([row_image(key, 1, f"user{key}")]), pos)
+                elif op == 1:
+                    event, pos = pack_event(ts, UPDATE_ROWS_EVENT_V2,
+                                            rows_body([row_image(key, 1, f"user{key}"),
+                                                       row_image(key, 2, f"user{key}")], update=True), pos)
+                else:
+                    event, pos = pack_event(ts, DELETE_ROWS_EVENT_V2,
+                                            rows_body([row_image(key, 2, f"user{key}")]), pos)
+                f.write(event)
+                if with_typed:
+                    event, pos, count = typed_rows_event(ts, row_id // TYPED_EVERY, pos)
+                    f.write(event)
+                    typed_rows += count
+                row_id += 1
+            if n < files:
+                event, pos = pack_event(ts, ROTATE_EVENT,
+                                        struct.pack('<Q', 4) + f"mysql-bin.{n + 1:06d}".encode(), pos)
+                f.write(event)
+    return row_id + typed_rows
+
+
+def binlog_time_range(binlog_dir):
+    # 扫描 binlog 文件，取行事件的最小/最大时间戳
+    timestamps = []
+    for name in sorted(os.listdir(binlog_dir)):
+        for _, event in read_events(os.path.join(binlog_dir, name)):
+            if event[4] in ROWS_EVENTS:
+                timestamps.append(struct.unpack('<I', event[:4])[0])
+    return min(timestamps), max(timestamps)
+
+
+def run_once(module, host, port, binlog_file, st, et, max_workers, workdir, summary=False, cache_dir=None,
+             full_parse=False, strict_raw=False):
+    # full_parse=True 时让统计模式的原始事件解析直接抛出 SummaryUnsupported，走改用完整解析的分支；
+    # strict_raw=True 时原始事件解析不应当失败（合成数据只包含支持的事件和列类型），失败即退出，避免被完整解析掩盖
+    reverse_sql = importlib.import_module(module)
+    reverse_sql.only_operation = None
+    reverse_sql.combined_array.clear()
+    reverse_sql.combined_array_replace.clear()
+
+    import binlog_summary
+    add_raw_events = binlog_summary.BinlogSummary.add_raw_events
+    if full_parse:
+        def add_raw_events_unsupported(self, *args, **kwargs):
+            raise binlog_summary.SummaryUnsupported("bench_reverse_sql.py 指定完整解析")
+        binlog_summary.BinlogSummary.add_raw_events = add_raw_events_unsupported
+    elif strict_raw:
+        def add_raw_events_strict(self, *args, **kwargs):
+            try:
+                return add_raw_events(self, *args, **kwargs)
+            except binlog_summary.SummaryUnsupported as e:
+                sys.exit(f"raw event summary failed on the fixture binlogs: {e}")
+        binlog_summary.BinlogSummary.add_raw_events = add_raw_events_strict
+
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    try:
+        started = time.perf_counter()
+        conn = reverse_sql.check_binlog_settings(mysql_host=host, mysql_port=port, mysql_user="bench", mysql_passwd="bench",
+                                                 mysql_database="hcy", mysql_charset="utf8")
+        reverse_sql.main(only_tables=None, only_operation=None, mysql_host=host, mysql_port=port, mysql_user="bench",
+                         mysql_passwd="bench", mysql_database="hcy", mysql_charset="utf8", binlog_file=binlog_file,
+                         binlog_pos=4, st=st, et=et, max_workers=max_workers, summary_output=summary, conn=conn,
+                         cache_dir=cache_dir, cache_size=10240)
+        elapsed = time.perf_counter() - started
+    finally:
+        os.chdir(cwd)
+        binlog_summary.BinlogSummary.add_raw_events = add_raw_events
+
+    # 统计模式下按 JSON 中的行数计数，否则按恢复文件中的回滚语句计数；
+    # 同时返回去掉文件名中生成时间后的 {文件名: 内容}，用于比对不同运行方式的输出
+    statements = 0
+    outputs = {}
+    for name in os.listdir(workdir):
+        with open(os.path.join(workdir, name), encoding="utf-8") as f:
+            content = f.read()
+        if name.endswith(".json"):
+            statements += sum(sum(ops.values()) for ops in json.loads(content)["totals"].values())
+        else:
+            statements += sum(1 for line in content.splitlines() if line.startswith("-- 回滚sql"))
+        outputs[re.sub(r"_\d{4}-\d\d-\d\d_\d\d:\d\d:\d\d", "", name)] = content
+        os.remove(os.path.join(workdir, name))
+    return elapsed, statements, outputs
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="reverse_sql 离线端到端吞吐量测试。")
+    parser.add_argument("--binlog-dir", dest="binlog_dir", type=str, help="回放的binlog文件目录，不指定则生成合成数据")
+    parser.add_argument("--files", dest="files", type=int, default=3, help="合成binlog文件个数，默认3")
+    parser.add_argument("--rows", dest="rows", type=int, default=30000, help="合成行事件总数，默认30000")
+    parser.add_argument("--rate", dest="rate", type=int, default=0, help="模拟服务每秒回放的事件数，默认0（不限速）")
+    parser.add_argument("--max-workers", dest="max_workers", type=int, default=4, help="线程数，默认4")
+    parser.add_argument("--repeat", dest="repeat", type=int, default=3, help="重复运行次数，默认3")
+    parser.add_argument("--summary", dest="summary", action="store_true", help="以--summary统计模式运行")
+    parser.add_argument("--module", dest="module", type=str, default="reverse_sql",
+                        choices=["reverse_sql", "reverse_sql_progress"], help="被测试的模块，默认reverse_sql")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        binlog_dir = args.binlog_dir
+        expected_rows = None
+        if not binlog_dir:
+            binlog_dir = os.path.join(tmpdir, "binlog")
+            os.mkdir(binlog_dir)
+            expected_rows = write_fixture_binlogs(binlog_dir, files=args.files, rows=args.rows)
+
+        server = FakeMySQLServer(binlog_dir, rate=args.rate)
+        host, port = server.start()
+        first_ts, last_ts = binlog_time_range(binlog_dir)
+        st = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(first_ts))
+        et = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(last_ts))
+
+        workdir = os.path.join(tmpdir, "output")
+        os.mkdir(workdir)
+        try:
+            for i in range(args.repeat):
+                elapsed, statements, outputs = run_once(args.module, host, port, server.binlog_files[0], st, et,
+                                                        args.max_workers, workdir, summary=args.summary,
+                                                        strict_raw=expected_rows is not None)
+                print(f"run {i + 1}: {statements} statements in {elapsed:.3f}s, "
+                      f"{statements / elapsed:.0f} statements/s")
+                # 合成数据的每一行都应当恰好生成一条语句，文件轮转或时间分片重连时丢失/重复事件都会导致数量不符
+                if expected_rows is not None and statements != expected_rows:
+                    sys.exit(f"run {i + 1}: expected {expected_rows} statements, got {statements}")
+
+            # 缓存一致性检查：首次运行写入缓存、第二次从缓存回放，输出都必须与不使用缓存时完全一致
+            cache_dir = os.path.join(tmpdir, "cache")
+            for label in ("cache write", "cache replay"):
+                elapsed, _, cached_outputs = run_once(args.module, host, port, server.binlog_files[0], st, et,
+                                                      args.max_workers, workdir, summary=args.summary,
+                                                      cache_dir=cache_dir, strict_raw=expected_rows is not None)
+                if cached_outputs != outputs:
+                    sys.exit(f"{label}: output differs from the uncached run")
+                print(f"{label}: output identical to uncached run ({elapsed:.3f}s)")
+
+            # 统计模式直接解析原始事件，结果必须与改用 pymysqlreplication 完整解析时完全一致
+            if args.summary:
+                with contextlib.redirect_stdout(io.StringIO()):
+                    elapsed, _, full_outputs = run_once(args.module, host, port, server.binlog_files[0], st, et,
+                                                        args.max_workers, workdir, summary=True, full_parse=True)
+                if full_outputs != outputs:
+                    sys.exit("full parse: summary differs from the raw event summary")
+                print(f"full parse: summary identical to raw event summary ({elapsed:.3f}s)")
+        finally:
+            server.stop()
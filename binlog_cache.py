@@ -0,0 +1,398 @@
+#!/usr/bin/env python3
+# binlog 本地缓存：首次运行时把从主库收到的原始 binlog 事件按 server_uuid/binlog 文件落盘，
+# 之后对同一区间的重复排查直接从本地磁盘回放，不再重复从主库拉取。
+import json
+import os
+import struct
+
+import pymysql
+from pymysql.protocol import MysqlPacket
+from pymysqlreplication import BinLogStreamReader
+from pymysqlreplication.event import FormatDescriptionEvent
+
+EVENT_HEADER_LEN = 19
+ROTATE_EVENT = 0x04
+FORMAT_DESCRIPTION_EVENT = 0x0f
+HEARTBEAT_LOG_EVENT = 0x1b
+LOG_EVENT_ARTIFICIAL_F = 0x20
+
+# 回放结束时返回给 BinLogStreamReader 的 EOF 包
+EOF_PACKET = b'\xfe\x00\x00\x02\x00'
+
+# 读取主库 FDE 时使用的 server_id，与 reverse_sql 读取 binlog 的 server_id 区分开
+FDE_CHECK_SERVER_ID = 1234567891
+
+# CachedBinLogStreamReader 需要接管 BinLogStreamReader 的私有方法和属性，只在验证过的 mysql-replication 版本上启用
+SUPPORTED_REPLICATION_VERSIONS = ('1.0.',)
+
+
+def check_reader_compatibility():
+    # 返回不能启用缓存的原因，可以启用时返回 None
+    try:
+        from importlib.metadata import version, PackageNotFoundError
+        try:
+            replication_version = version('mysql-replication')
+        except PackageNotFoundError:
+            # 打包后的可执行文件中可能没有包元数据，只做下面的结构检查
+            replication_version = None
+    except ImportError:
+        replication_version = None
+
+    if replication_version and not replication_version.startswith(SUPPORTED_REPLICATION_VERSIONS):
+        return f"mysql-replication {replication_version} 未经验证（支持 {'/'.join(v + 'x' for v in SUPPORTED_REPLICATION_VERSIONS)}）"
+    if not callable(getattr(BinLogStreamReader, '_BinLogStreamReader__connect_to_stream', None)):
+        return "当前 mysql-replication 的 BinLogStreamReader 内部结构已变化"
+    return None
+
+
+def get_server_state(connection_settings, conn=None):
+    # 返回 (server_uuid, {binlog 文件名: 文件大小})，MariaDB 没有 server_uuid，退化为 host:port:server_id；
+    # 传入 conn 时复用该连接，且不关闭
+    own_conn = conn is None
+    if own_conn:
+        conn = pymysql.connect(**connection_settings)
+    cursor = conn.cursor()
+    try:
+        try:
+            cursor.execute("SELECT @@server_uuid")
+            server_uuid = cursor.fetchone()[0]
+        except pymysql.err.MySQLError:
+            cursor.execute("SELECT @@server_id")
+            server_uuid = f"{connection_settings['host']}_{connection_settings['port']}_{cursor.fetchone()[0]}"
+        cursor.execute("SHOW BINARY LOGS")
+        binary_logs = {row[0]: int(row[1]) for row in cursor.fetchall()}
+        return server_uuid, binary_logs
+    finally:
+        cursor.close()
+        if own_conn:
+            conn.close()
+
+
+def get_server_fde_timestamp(connection_settings, log_file):
+    # 从主库读取 binlog 文件开头的 FDE 事件，其时间戳即该文件的创建时间
+    stream = BinLogStreamReader(
+        connection_settings=dict(connection_settings),
+        server_id=FDE_CHECK_SERVER_ID,
+        blocking=False,
+        resume_stream=True,
+        only_events=[FormatDescriptionEvent],
+        log_file=log_file,
+        log_pos=4
+    )
+    try:
+        event = stream.fetchone()
+        return event.timestamp if event is not None else None
+    finally:
+        stream.close()
+
+
+class BinlogCache:
+    # 每个 binlog 文件对应两个文件：
+    #   {binlog_file}.bin  从 start 开始连续的原始事件（与 binlog 文件中的字节完全一致）
+    #   {binlog_file}.json 索引：start/end 位置、是否已轮转完毕(sealed)、下一个文件名、checksum、FDE 事件
+    def __init__(self, cache_dir, server_uuid, max_bytes, binary_logs=None, connection_settings=None):
+        self.cache_dir = cache_dir
+        self.server_dir = os.path.join(cache_dir, server_uuid.replace(':', '_'))
+        self.max_bytes = max_bytes
+        self.connection_settings = connection_settings
+        # 已与主库核对过 FDE 的文件，每个文件每次运行只核对一次
+        self.verified = set()
+        os.makedirs(self.server_dir, exist_ok=True)
+        if binary_logs is not None:
+            self.drop_stale(binary_logs)
+
+    def data_path(self, log_file):
+        return os.path.join(self.server_dir, log_file + '.bin')
+
+    def index_path(self, log_file):
+        return os.path.join(self.server_dir, log_file + '.json')
+
+    def load_index(self, log_file):
+        try:
+            with open(self.index_path(log_file), encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def save_index(self, log_file, index):
+        path = self.index_path(log_file)
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(index, f)
+        os.replace(tmp_path, path)
+
+    def remove(self, log_file):
+        for path in (self.data_path(log_file), self.index_path(log_file)):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def drop_stale(self, binary_logs):
+        # RESET MASTER 之后，同一 server_uuid 下的 binlog 文件名会被重新使用，按 SHOW BINARY LOGS 的文件大小校验缓存：
+        # 已轮转完毕的文件大小必须等于缓存的结束位置，当前文件不能比缓存的内容短，主库上已不存在的文件不再使用
+        for entry in os.scandir(self.server_dir):
+            if not entry.name.endswith('.json'):
+                continue
+            log_file = entry.name[:-len('.json')]
+            index = self.load_index(log_file)
+            size = binary_logs.get(log_file)
+            if index is None or size is None or size < index['end'] or (index['sealed'] and size != index['end']):
+                self.remove(log_file)
+
+    def is_current(self, log_file, index):
+        # 文件大小相同的重建文件无法靠 SHOW BINARY LOGS 区分，回放前再比对缓存的 FDE 与主库 FDE 的时间戳
+        if self.connection_settings is None or log_file in self.verified:
+            return True
+        if index.get('fde'):
+            cached_timestamp = struct.unpack('<I', bytes.fromhex(index['fde'][:8]))[0]
+            if cached_timestamp == get_server_fde_timestamp(self.connection_settings, log_file):
+                self.verified.add(log_file)
+                return True
+        self.remove(log_file)
+        return False
+
+    def open_replay(self, log_file, log_pos):
+        index = self.load_index(log_file)
+        if index is None or not (index['start'] <= log_pos < index['end']) or not self.is_current(log_file, index):
+            return None
+        return ReplayConnection(self, log_file, log_pos, index)
+
+    def writer(self, use_checksum):
+        return CacheWriter(self, use_checksum)
+
+    def evict(self):
+        # 按最近使用时间（data 文件 mtime）做 LRU 淘汰，直到总大小不超过上限
+        entries = []
+        total = 0
+        for server_dir in os.scandir(self.cache_dir):
+            if not server_dir.is_dir():
+                continue
+            for entry in os.scandir(server_dir.path):
+                if entry.name.endswith('.bin'):
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+                    total += stat.st_size
+
+        entries.sort()
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            for p in (path, path[:-len('.bin')] + '.json'):
+                try:
+                    os.remove(p)
+                except OSError:
+                    pass
+            total -= size
+
+
+class ReplayConnection:
+    # 代替 BinLogStreamReader 的 _stream_connection，从本地缓存读取事件包
+    def __init__(self, cache, log_file, log_pos, index):
+        self.cache = cache
+        self.checksum = index['checksum']
+        self._pending = []
+        self._file = None
+        self._open(log_file, log_pos, index)
+
+        # 从文件中间开始时，与主库一样先补发一个 log_pos 为 0 的 FDE 事件
+        if log_pos > 4 and index.get('fde'):
+            fde = bytearray.fromhex(index['fde'])
+            fde[13:17] = b'\x00\x00\x00\x00'
+            self._pending.append(bytes(fde))
+
+    def _open(self, log_file, log_pos, index):
+        if self._file:
+            self._file.close()
+        self.log_file = log_file
+        self.index = index
+        path = self.cache.data_path(log_file)
+        os.utime(path)
+        self._file = open(path, 'rb')
+        self._file.seek(log_pos - index['start'])
+
+    def _next_event(self):
+        if self._pending:
+            return self._pending.pop(0)
+
+        while True:
+            # 只读取索引中记录过的区间，忽略异常退出时残留的数据
+            if self.index['start'] + self._file.tell() < self.index['end']:
+                header = self._file.read(EVENT_HEADER_LEN)
+                event_size = struct.unpack('<I', header[9:13])[0]
+                return header + self._file.read(event_size - EVENT_HEADER_LEN)
+
+            # 当前文件已回放完，若已轮转且下一个文件从头缓存过，则继续回放下一个文件
+            next_file = self.index.get('next_file')
+            if not self.index.get('sealed') or not next_file:
+                return None
+            next_index = self.cache.load_index(next_file)
+            if next_index is None or next_index['start'] != 4 or not self.cache.is_current(next_file, next_index):
+                return None
+            self._open(next_file, 4, next_index)
+
+    def _read_packet(self, *args, **kwargs):
+        event = self._next_event()
+        if event is None:
+            return MysqlPacket(EOF_PACKET, 'utf8')
+        return MysqlPacket(b'\x00' + event, 'utf8')
+
+    def close(self):
+        if self._file:
+            self._file.close()
+            self._file = None
+
+
+class CacheWriter:
+    # 旁路记录主库发来的原始事件包，只缓存连续区间，出现断档时从新位置重新缓存
+    def __init__(self, cache, use_checksum):
+        self.cache = cache
+        self.use_checksum = use_checksum
+        self.log_file = None
+        self.index = None
+        self._file = None
+        # 当前文件最近收到的 FDE，重新开始缓存时写入新的索引
+        self.fde = None
+
+    def _switch(self, log_file):
+        if log_file == self.log_file:
+            return
+        self._flush()
+        self.log_file = log_file
+        self.fde = None
+        self.index = self.cache.load_index(log_file)
+        if self.index is not None and not self.index['sealed']:
+            # 截掉上次异常退出时可能残留的、未记入索引的数据
+            self._file = open(self.cache.data_path(log_file), 'r+b')
+            self._file.truncate(self.index['end'] - self.index['start'])
+            self._file.seek(0, os.SEEK_END)
+
+    def _flush(self):
+        if self._file:
+            self._file.close()
+            self._file = None
+        if self.index is not None:
+            self.cache.save_index(self.log_file, self.index)
+
+    def _append(self, start, event):
+        index = self.index
+        if index is not None and (index['sealed'] or index['start'] <= start < index['end']):
+            return
+
+        if index is None or index['end'] != start:
+            if self._file:
+                self._file.close()
+            self._file = open(self.cache.data_path(self.log_file), 'wb')
+            self.index = index = {"start": start, "end": start, "sealed": False, "next_file": None,
+                                  "checksum": self.use_checksum, "fde": index.get('fde') if index else self.fde}
+
+        self._file.write(event)
+        index['end'] = start + len(event)
+
+    def _check_fde(self, event):
+        # FDE 的时间戳是 binlog 文件的创建时间，与缓存中的不一致说明文件已被重建（如 RESET MASTER），丢弃旧缓存
+        if self.index is None or not self.index.get('fde') or bytes.fromhex(self.index['fde'][:8]) == event[:4]:
+            return
+        if self._file:
+            self._file.close()
+            self._file = None
+        self.cache.remove(self.log_file)
+        self.index = None
+
+    def feed(self, data):
+        if len(data) < EVENT_HEADER_LEN + 1 or data[0] != 0:
+            return
+        event = bytes(data[1:])
+        _, event_type, _, event_size, log_pos, flags = struct.unpack('<IBIIIH', event[:EVENT_HEADER_LEN])
+
+        if event_type == HEARTBEAT_LOG_EVENT:
+            return
+
+        if event_type == ROTATE_EVENT and (log_pos == 0 or flags & LOG_EVENT_ARTIFICIAL_F):
+            # 主库伪造的 rotate 事件，仅用于告知当前所在的 binlog 文件
+            body_end = event_size - 4 if self.use_checksum else event_size
+            self._switch(event[EVENT_HEADER_LEN + 8:body_end].decode())
+            return
+
+        if self.log_file is None:
+            return
+
+        if event_type == FORMAT_DESCRIPTION_EVENT:
+            self._check_fde(event)
+            self.fde = event.hex()
+
+        if log_pos == 0:
+            if event_type == FORMAT_DESCRIPTION_EVENT and self.index is not None and not self.index.get('fde'):
+                self.index['fde'] = event.hex()
+            return
+
+        start = log_pos - event_size
+        self._append(start, event)
+        if self.index is None:
+            return
+
+        if event_type == FORMAT_DESCRIPTION_EVENT and start == 4:
+            self.index['fde'] = event.hex()
+        elif event_type == ROTATE_EVENT and not self.index['sealed']:
+            # 真实的 rotate 事件位于文件末尾，之后该文件内容不会再变化
+            body_end = event_size - 4 if self.use_checksum else event_size
+            self.index['sealed'] = True
+            self.index['next_file'] = event[EVENT_HEADER_LEN + 8:body_end].decode()
+            self._flush()
+            self.log_file = None
+            self.index = None
+
+    def close(self):
+        self._flush()
+        self.log_file = None
+        self.index = None
+        self.cache.evict()
+
+
+class CachedBinLogStreamReader(BinLogStreamReader):
+    # 优先从本地缓存回放；缓存读完后从断点处连接主库继续读取，并把新读到的事件写入缓存
+    def __init__(self, *args, binlog_cache=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.binlog_cache = binlog_cache
+        self._replaying = False
+        self._cache_exhausted = False
+        self._cache_writer = None
+
+    def _BinLogStreamReader__connect_to_stream(self):
+        if not self._cache_exhausted:
+            replay = self.binlog_cache.open_replay(self.log_file, int(self.log_pos))
+            if replay is not None:
+                self._stream_connection = replay
+                self._BinLogStreamReader__use_checksum = replay.checksum
+                self._BinLogStreamReader__connected_stream = True
+                self._replaying = True
+                return
+
+        super()._BinLogStreamReader__connect_to_stream()
+        self._replaying = False
+        self._cache_writer = self.binlog_cache.writer(self._BinLogStreamReader__use_checksum)
+
+        read_packet = self._stream_connection._read_packet
+        cache_writer = self._cache_writer
+
+        def _read_packet(*args, **kwargs):
+            packet = read_packet(*args, **kwargs)
+            cache_writer.feed(packet.get_all_data())
+            return packet
+
+        self._stream_connection._read_packet = _read_packet
+
+    def fetchone(self):
+        binlogevent = super().fetchone()
+        if binlogevent is None and self._replaying:
+            # 缓存已回放完，从当前 log_file/log_pos 连接主库继续读取
+            self._replaying = False
+            self._cache_exhausted = True
+            binlogevent = super().fetchone()
+        return binlogevent
+
+    def close(self):
+        super().close()
+        if self._cache_writer is not None:
+            self._cache_writer.close()
+            self._cache_writer = None
@@ -0,0 +1,10 @@
+#!/usr/bin/env python3
+# 行事件的通用辅助函数，供 --verify（rollback_verify.py）和 --index（recover_index.py）共用，两者互不依赖。
+
+
+def event_primary_key(binlogevent):
+    # pymysqlreplication 对单列主键返回字符串、联合主键返回元组、无主键返回空值，统一成列名元组
+    primary_key = binlogevent.primary_key
+    if isinstance(primary_key, str):
+        return (primary_key,) if primary_key else ()
+    return tuple(primary_key or ())
@@ -0,0 +1,355 @@
+#!/usr/bin/env python3
+# 快速统计模式：不生成 SQL，只按 库.表 × 操作类型 × 时间段 汇总行数和起止 binlog 位点，
+# 用于故障初期快速判断哪些表在什么时间被改动，再用精确位点做针对性的完整解析。
+#
+# 统计只需要表名和行数，read_raw_events() 直接发送 COM_BINLOG_DUMP 读取原始事件，只解析 TableMap 中的列类型和
+# 元数据、按列宽度跳过行数据来计数，不构造列信息和行数据；遇到不支持的事件或列类型时抛出 SummaryUnsupported，
+# 由调用方改用 pymysqlreplication 完整解析（BinlogSummary.add）。
+import datetime
+import json
+import struct
+
+from pymysqlreplication.row_event import (
+    WriteRowsEvent,
+    UpdateRowsEvent,
+    DeleteRowsEvent,
+    TableMapEvent
+)
+
+OPERATIONS = {WriteRowsEvent: 'insert', UpdateRowsEvent: 'update', DeleteRowsEvent: 'delete'}
+
+EVENT_HEADER_LEN = 19
+COM_BINLOG_DUMP = 0x12
+BINLOG_DUMP_NON_BLOCK = 0x01
+ROTATE_EVENT = 0x04
+FORMAT_DESCRIPTION_EVENT = 0x0f
+TABLE_MAP_EVENT = 0x13
+# v0/v1/v2 三个版本的行事件
+RAW_OPERATIONS = {20: 'insert', 21: 'update', 22: 'delete',
+                  23: 'insert', 24: 'update', 25: 'delete',
+                  30: 'insert', 31: 'update', 32: 'delete'}
+ROWS_EVENT_V2 = (30, 31, 32)
+# PARTIAL_UPDATE_ROWS_EVENT、TRANSACTION_PAYLOAD_EVENT（binlog 压缩）以及 MariaDB 的压缩事件需要完整解析
+UNSUPPORTED_EVENTS = {39: 'PARTIAL_UPDATE_ROWS_EVENT', 40: 'TRANSACTION_PAYLOAD_EVENT',
+                      166: 'QUERY_COMPRESSED_EVENT', 169: 'WRITE_ROWS_COMPRESSED_EVENT_V1',
+                      170: 'UPDATE_ROWS_COMPRESSED_EVENT_V1', 171: 'DELETE_ROWS_COMPRESSED_EVENT_V1'}
+
+# 定长列的字节数
+FIXED_SIZES = {1: 1, 2: 2, 3: 4, 4: 4, 5: 8, 6: 0, 7: 4, 8: 8, 9: 3, 10: 3, 11: 3, 12: 8, 13: 1, 14: 3}
+# TableMap 中元数据为 1 个字节的列类型：FLOAT/DOUBLE、TIMESTAMP2/DATETIME2/TIME2、VECTOR/JSON/BLOB/GEOMETRY
+ONE_BYTE_META = {4, 5, 17, 18, 19, 242, 245, 249, 250, 251, 252, 255}
+# 值前面带长度前缀（前缀字节数为元数据）的列类型：VECTOR/JSON/BLOB/GEOMETRY
+LENGTH_PREFIXED = {242, 245, 249, 250, 251, 252, 255}
+DIG2BYTES = (0, 1, 1, 2, 2, 3, 3, 4, 4, 4)
+
+
+class SummaryUnsupported(Exception):
+    pass
+
+
+def lenenc_int(buf, pos):
+    first = buf[pos]
+    if first < 251:
+        return first, pos + 1
+    if first == 0xfc:
+        return struct.unpack_from('<H', buf, pos + 1)[0], pos + 3
+    if first == 0xfd:
+        return int.from_bytes(buf[pos + 1:pos + 4], 'little'), pos + 4
+    return struct.unpack_from('<Q', buf, pos + 1)[0], pos + 9
+
+
+def read_table_map(event, table_id_size, body_end):
+    # 返回 (table_id, schema, table, 列类型, 列元数据)
+    pos = EVENT_HEADER_LEN
+    table_id = int.from_bytes(event[pos:pos + table_id_size], 'little')
+    pos += table_id_size + 2
+    schema = event[pos + 1:pos + 1 + event[pos]].decode('utf-8', 'replace')
+    pos += event[pos] + 2
+    table = event[pos + 1:pos + 1 + event[pos]].decode('utf-8', 'replace')
+    pos += event[pos] + 2
+    column_count, pos = lenenc_int(event, pos)
+    types = event[pos:pos + column_count]
+    pos += column_count
+    meta_len, pos = lenenc_int(event, pos)
+    meta_end = pos + meta_len
+
+    metas = []
+    for column_type in types:
+        if column_type in ONE_BYTE_META:
+            metas.append(event[pos])
+            pos += 1
+        elif column_type in (15, 16):
+            # VARCHAR 为最大长度（小端），BIT 为 位数 + 字节数<<8
+            metas.append(event[pos] | event[pos + 1] << 8)
+            pos += 2
+        elif column_type in (246, 247, 248, 253, 254):
+            # NEWDECIMAL 为 精度<<8 + 小数位，ENUM/SET/STRING 为 实际类型<<8 + 长度
+            metas.append(event[pos] << 8 | event[pos + 1])
+            pos += 2
+        else:
+            metas.append(0)
+    if pos != meta_end or pos > body_end:
+        raise SummaryUnsupported(f"TableMap 事件中的列元数据无法识别（{schema}.{table}）")
+    return table_id, schema, table, bytes(types), metas
+
+
+def value_size(column_type, meta, buf, pos):
+    size = FIXED_SIZES.get(column_type)
+    if size is not None:
+        return size
+    if column_type in (15, 253):
+        return 1 + buf[pos] if meta < 256 else 2 + struct.unpack_from('<H', buf, pos)[0]
+    if column_type == 254:
+        real_type = meta >> 8
+        if real_type in (247, 248):
+            return meta & 0xff
+        max_length = (((meta >> 4) & 0x300) ^ 0x300) + (meta & 0xff)
+        return 1 + buf[pos] if max_length < 256 else 2 + struct.unpack_from('<H', buf, pos)[0]
+    if column_type in LENGTH_PREFIXED:
+        return meta + int.from_bytes(buf[pos:pos + meta], 'little')
+    if column_type in (17, 18, 19):
+        return {17: 4, 18: 5, 19: 3}[column_type] + (meta + 1) // 2
+    if column_type == 246:
+        precision, scale = meta >> 8, meta & 0xff
+        integer = precision - scale
+        return integer // 9 * 4 + DIG2BYTES[integer % 9] + scale // 9 * 4 + DIG2BYTES[scale % 9]
+    if column_type in (247, 248):
+        return meta & 0xff
+    if column_type == 16:
+        return (meta >> 8) + (1 if meta & 0xff else 0)
+    raise SummaryUnsupported(f"不支持的列类型 {column_type}")
+
+
+def skip_row_image(buf, pos, table_map, present):
+    # present 为该镜像中出现的列下标，NULL 位图只覆盖出现的列
+    types, metas = table_map[3], table_map[4]
+    null_bitmap = buf[pos:pos + (len(present) + 7) // 8]
+    pos += len(null_bitmap)
+    for i, column in enumerate(present):
+        if not null_bitmap[i >> 3] & (1 << (i & 7)):
+            pos += value_size(types[column], metas[column], buf, pos)
+    return pos
+
+
+def count_rows(event, event_type, table_id_size, post_header_len, body_end, table_map):
+    pos = EVENT_HEADER_LEN + table_id_size + 2
+    if event_type in ROWS_EVENT_V2:
+        extra_len = struct.unpack_from('<H', event, pos)[0]
+        pos += extra_len
+    else:
+        pos = EVENT_HEADER_LEN + post_header_len
+    column_count, pos = lenenc_int(event, pos)
+    if column_count != len(table_map[3]):
+        raise SummaryUnsupported("行事件的列数与 TableMap 不一致")
+
+    bitmap_len = (column_count + 7) // 8
+    present = [i for i in range(column_count) if event[pos + (i >> 3)] & (1 << (i & 7))]
+    pos += bitmap_len
+    present_after = present
+    if RAW_OPERATIONS[event_type] == 'update':
+        present_after = [i for i in range(column_count) if event[pos + (i >> 3)] & (1 << (i & 7))]
+        pos += bitmap_len
+
+    rows = 0
+    while pos < body_end:
+        pos = skip_row_image(event, pos, table_map, present)
+        if RAW_OPERATIONS[event_type] == 'update':
+            pos = skip_row_image(event, pos, table_map, present_after)
+        rows += 1
+    if pos != body_end:
+        raise SummaryUnsupported("行事件长度与列定义不一致")
+    return rows
+
+
+def open_dump(conn, log_file, log_pos, server_id):
+    # 与 BinLogStreamReader 一样设置 checksum 后发送 COM_BINLOG_DUMP（非阻塞，读到末尾时主库返回 EOF）
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SHOW GLOBAL VARIABLES LIKE 'BINLOG_CHECKSUM'")
+        row = cursor.fetchone()
+        use_checksum = bool(row and row[1] != 'NONE')
+        if use_checksum:
+            cursor.execute("SET @master_binlog_checksum= @@global.binlog_checksum")
+        cursor.execute("SET @mariadb_slave_capability=4")
+    finally:
+        cursor.close()
+
+    prelude = struct.pack('<i', len(log_file) + 11) + bytes([COM_BINLOG_DUMP])
+    prelude += struct.pack('<IHI', log_pos, BINLOG_DUMP_NON_BLOCK, server_id) + log_file.encode()
+    conn._write_bytes(prelude)
+    conn._next_seq_id = 1
+    return use_checksum
+
+
+def read_raw_events(connect, log_file, log_pos, server_id, binlog_cache=None):
+    # 依次返回 (当前 binlog 文件, 原始事件, 是否带 checksum)；启用缓存时先从缓存回放，读完后再从断点连接主库
+    replay = binlog_cache.open_replay(log_file, log_pos) if binlog_cache else None
+    if replay is not None:
+        try:
+            log_file = replay.log_file
+            while True:
+                packet = replay._read_packet()
+                if packet.is_eof_packet():
+                    break
+                event = packet.get_all_data()[1:]
+                log_file, log_pos = track_position(log_file, log_pos, event, replay.checksum)
+                yield log_file, event, replay.checksum
+        finally:
+            replay.close()
+
+    conn = connect()
+    cache_writer = None
+    try:
+        use_checksum = open_dump(conn, log_file, log_pos, server_id)
+        if binlog_cache:
+            cache_writer = binlog_cache.writer(use_checksum)
+        while True:
+            packet = conn._read_packet()
+            if packet.is_eof_packet():
+                break
+            data = packet.get_all_data()
+            if cache_writer:
+                cache_writer.feed(data)
+            event = data[1:]
+            log_file, log_pos = track_position(log_file, log_pos, event, use_checksum)
+            yield log_file, event, use_checksum
+    finally:
+        conn.close()
+        if cache_writer:
+            cache_writer.close()
+
+
+def track_position(log_file, log_pos, event, use_checksum):
+    event_type = event[4]
+    if event_type == ROTATE_EVENT:
+        body_end = len(event) - 4 if use_checksum else len(event)
+        return event[EVENT_HEADER_LEN + 8:body_end].decode(), struct.unpack_from('<Q', event, EVENT_HEADER_LEN)[0]
+    next_pos = struct.unpack_from('<I', event, 13)[0]
+    return log_file, next_pos or log_pos
+
+
+class BinlogSummary:
+
+    def __init__(self, timezone, bucket_seconds=60, only_operation=None):
+        self.timezone = timezone
+        self.bucket_seconds = bucket_seconds
+        self.only_operation = only_operation
+        self.groups = {}
+        self.current_bucket = None
+        self.bucket_rows = 0
+        # 每个 table_id 最近一次 TableMap 事件的起始位点。多表语句会先写出所有表的 TableMap 再写行事件，
+        # 必须取本表的 TableMap 位点，从这里开始解析才能拿到该表的结构
+        self.table_map_pos = {}
+
+    def format_time(self, timestamp, fmt='%Y-%m-%d %H:%M'):
+        return datetime.datetime.fromtimestamp(timestamp, tz=self.timezone).strftime(fmt)
+
+    def add(self, binlogevent, log_file):
+        packet = binlogevent.packet
+        if isinstance(binlogevent, TableMapEvent):
+            self.table_map_pos[binlogevent.table_id] = (log_file, packet.log_pos - packet.event_size)
+            return
+
+        operation = OPERATIONS.get(type(binlogevent))
+        if operation is None:
+            return
+        self.add_rows(binlogevent.schema, binlogevent.table, operation, binlogevent.timestamp, len(binlogevent.rows),
+                      log_file, packet.log_pos - packet.event_size, packet.log_pos, binlogevent.table_id)
+
+    def add_rows(self, schema, table, operation, timestamp, rows, log_file, start_pos, end_pos, table_id):
+        if self.only_operation and operation != self.only_operation:
+            return
+
+        bucket = timestamp - timestamp % self.bucket_seconds
+        if bucket != self.current_bucket:
+            self.flush_bucket()
+            self.current_bucket = bucket
+
+        self.bucket_rows += rows
+        key = (schema, table, operation, bucket)
+        group = self.groups.get(key)
+        if group is None:
+            first_file, first_pos = self.table_map_pos.get(table_id) or (log_file, start_pos)
+            group = self.groups[key] = {
+                "schema": schema,
+                "table": table,
+                "operation": operation,
+                "bucket": self.format_time(bucket),
+                "events": 0,
+                "rows": 0,
+                "first_binlog_file": first_file,
+                "first_binlog_pos": first_pos,
+            }
+        group["events"] += 1
+        group["rows"] += rows
+        group["last_binlog_file"] = log_file
+        group["last_binlog_pos"] = end_pos
+
+    def add_raw_events(self, events, start_time, end_time, only_tables=None):
+        # events 为 read_raw_events() 的输出，时间范围的处理与完整解析时一致：早于起始时间的行事件跳过，
+        # 遇到晚于结束时间的行事件即停止
+        table_maps = {}
+        # FDE 中各事件类型的 post-header 长度，用于确定 table_id 的字节数（MySQL 5.1 之前为 4 字节）
+        post_header_lens = b''
+        for log_file, event, use_checksum in events:
+            event_type = event[4]
+            body_end = len(event) - 4 if use_checksum else len(event)
+
+            if event_type == FORMAT_DESCRIPTION_EVENT:
+                post_header_lens = event[EVENT_HEADER_LEN + 57:body_end]
+            elif event_type == TABLE_MAP_EVENT:
+                table_id_size = 4 if post_header_lens[TABLE_MAP_EVENT - 1:TABLE_MAP_EVENT] == b'\x06' else 6
+                try:
+                    table_map = read_table_map(event, table_id_size, body_end)
+                except (IndexError, struct.error):
+                    raise SummaryUnsupported("TableMap 事件格式无法识别")
+                table_maps[table_map[0]] = table_map
+                event_size, log_pos = struct.unpack_from('<II', event, 9)
+                self.table_map_pos[table_map[0]] = (log_file, log_pos - event_size)
+            elif event_type in RAW_OPERATIONS:
+                timestamp = struct.unpack_from('<I', event, 0)[0]
+                if timestamp < start_time:
+                    continue
+                elif timestamp > end_time:
+                    break
+                post_header_len = post_header_lens[event_type - 1] if len(post_header_lens) >= event_type else 10
+                table_id_size = 4 if post_header_len == 6 else 6
+                table_id = int.from_bytes(event[EVENT_HEADER_LEN:EVENT_HEADER_LEN + table_id_size], 'little')
+                table_map = table_maps.get(table_id)
+                if table_map is None or (only_tables and table_map[2] not in only_tables):
+                    continue
+                try:
+                    rows = count_rows(event, event_type, table_id_size, post_header_len, body_end, table_map)
+                except (IndexError, struct.error):
+                    raise SummaryUnsupported(f"行事件格式无法识别（{table_map[1]}.{table_map[2]}）")
+                event_size, log_pos = struct.unpack_from('<II', event, 9)
+                self.add_rows(table_map[1], table_map[2], RAW_OPERATIONS[event_type], timestamp, rows,
+                              log_file, log_pos - event_size, log_pos, table_id)
+            elif event_type in UNSUPPORTED_EVENTS:
+                raise SummaryUnsupported(f"binlog 中包含 {UNSUPPORTED_EVENTS[event_type]}")
+
+    def flush_bucket(self):
+        # 每个时间段统计完后立即输出一行，便于尽早看到结果
+        if self.current_bucket is not None and self.bucket_rows:
+            print(f"-- {self.format_time(self.current_bucket)} 已统计 {self.bucket_rows} 行")
+        self.bucket_rows = 0
+
+    def report(self, filename, st=None, et=None):
+        self.flush_bucket()
+        groups = sorted(self.groups.values(), key=lambda g: (g["bucket"], g["schema"], g["table"], g["operation"]))
+
+        print(f"\n{'时间段':<16}\t{'表':<30}\t{'操作':<6}\t{'行数':>8}\t{'起始位点':<30}\t结束位点")
+        for g in groups:
+            print(f"{g['bucket']:<16}\t{g['schema'] + '.' + g['table']:<30}\t{g['operation']:<6}\t{g['rows']:>8}\t"
+                  f"{g['first_binlog_file'] + ':' + str(g['first_binlog_pos']):<30}\t"
+                  f"{g['last_binlog_file']}:{g['last_binlog_pos']}")
+
+        totals = {}
+        for g in groups:
+            table_totals = totals.setdefault(f"{g['schema']}.{g['table']}", {"insert": 0, "update": 0, "delete": 0})
+            table_totals[g["operation"]] += g["rows"]
+
+        with open(filename, "w", encoding="utf-8") as file:
+            json.dump({"start_time": st, "end_time": et, "bucket_seconds": self.bucket_seconds,
+                       "totals": totals, "groups": groups}, file, ensure_ascii=False, indent=2)
+        print(f"\n统计结果已写入 {filename}")
@@ -0,0 +1,297 @@
+#!/usr/bin/env python3
+# 本地 MySQL 复制协议模拟服务：按可控速率回放目录下的 binlog 文件，
+# 只实现 reverse_sql 用到的部分（握手、SET/SHOW VARIABLES/SHOW BINARY LOGS/SELECT @@var、COM_BINLOG_DUMP），
+# 用于在没有真实 MySQL 的环境下做端到端吞吐量测试。
+import argparse
+import os
+import re
+import socketserver
+import struct
+import threading
+import time
+import uuid
+import zlib
+
+BINLOG_MAGIC = b'\xfebin'
+EVENT_HEADER_LEN = 19
+ROTATE_EVENT = 0x04
+FORMAT_DESCRIPTION_EVENT = 0x0f
+LOG_EVENT_ARTIFICIAL_F = 0x20
+
+COM_QUIT = 0x01
+COM_INIT_DB = 0x02
+COM_QUERY = 0x03
+COM_PING = 0x0e
+COM_BINLOG_DUMP = 0x12
+COM_REGISTER_SLAVE = 0x15
+
+# CLIENT_LONG_PASSWORD | CLIENT_LONG_FLAG | CLIENT_CONNECT_WITH_DB | CLIENT_PROTOCOL_41 |
+# CLIENT_TRANSACTIONS | CLIENT_SECURE_CONNECTION | CLIENT_MULTI_RESULTS | CLIENT_PLUGIN_AUTH
+SERVER_CAPABILITIES = 0x1 | 0x4 | 0x8 | 0x200 | 0x2000 | 0x8000 | 0x20000 | 0x80000
+SERVER_STATUS_AUTOCOMMIT = 0x0002
+FIELD_TYPE_VAR_STRING = 0xfd
+ER_PARSE_ERROR = 1064
+
+
+def lenenc_int(n):
+    if n < 251:
+        return bytes([n])
+    if n < 1 << 16:
+        return b'\xfc' + struct.pack('<H', n)
+    if n < 1 << 24:
+        return b'\xfd' + struct.pack('<I', n)[:3]
+    return b'\xfe' + struct.pack('<Q', n)
+
+
+def lenenc_str(s):
+    if s is None:
+        return b'\xfb'
+    if not isinstance(s, bytes):
+        s = str(s).encode()
+    return lenenc_int(len(s)) + s
+
+
+def read_events(path, start_pos=4):
+    # 逐个读取 binlog 文件中的事件，返回 (事件起始位置, 事件字节)
+    with open(path, 'rb') as f:
+        if f.read(4) != BINLOG_MAGIC:
+            raise ValueError(f"{path} 不是有效的 binlog 文件")
+        f.seek(start_pos)
+        pos = start_pos
+        while True:
+            header = f.read(EVENT_HEADER_LEN)
+            if len(header) < EVENT_HEADER_LEN:
+                return
+            event_size = struct.unpack('<I', header[9:13])[0]
+            event = header + f.read(event_size - EVENT_HEADER_LEN)
+            yield pos, event
+            pos += event_size
+
+
+class FakeMySQLServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, binlog_dir, host='127.0.0.1', port=0, rate=0, variables=None):
+        super().__init__((host, port), FakeMySQLHandler)
+        self.binlog_dir = binlog_dir
+        self.rate = rate
+        self.binlog_files = sorted(
+            name for name in os.listdir(binlog_dir)
+            if re.search(r'\.\d+$', name) and os.path.isfile(os.path.join(binlog_dir, name)))
+        if not self.binlog_files:
+            raise ValueError(f"{binlog_dir} 下没有 binlog 文件")
+
+        # 根据第一个文件的 FDE 判断是否开启了 binlog checksum
+        _, fde = next(read_events(self.binlog_path(self.binlog_files[0])))
+        checksum = 'CRC32' if fde[-5] == 1 else 'NONE'
+
+        self.variables = {
+            'version': '8.0.36-fake',
+            'server_id': '1',
+            'server_uuid': str(uuid.uuid5(uuid.NAMESPACE_URL, os.path.abspath(binlog_dir))),
+            'binlog_format': 'ROW',
+            'binlog_row_image': 'FULL',
+            'binlog_row_metadata': 'FULL',
+            'binlog_checksum': checksum,
+        }
+        if variables:
+            self.variables.update({k.lower(): v for k, v in variables.items()})
+        self.use_checksum = self.variables['binlog_checksum'].upper() != 'NONE'
+
+    def binlog_path(self, name):
+        return os.path.join(self.binlog_dir, name)
+
+    def start(self):
+        # 在后台线程中运行，返回监听地址 (host, port)
+        thread = threading.Thread(target=self.serve_forever, daemon=True)
+        thread.start()
+        return self.server_address
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+class FakeMySQLHandler(socketserver.BaseRequestHandler):
+
+    def setup(self):
+        self.seq = 0
+        self.rfile = self.request.makefile('rb')
+
+    def finish(self):
+        self.rfile.close()
+
+    def send_packet(self, payload):
+        # 超过 16M 的包需要拆分发送
+        while True:
+            chunk, payload = payload[:0xffffff], payload[0xffffff:]
+            self.request.sendall(struct.pack('<I', len(chunk))[:3] + bytes([self.seq]) + chunk)
+            self.seq = (self.seq + 1) % 256
+            if len(chunk) < 0xffffff:
+                return
+
+    def read_packet(self):
+        payload = b''
+        while True:
+            header = self.rfile.read(4)
+            if len(header) < 4:
+                return None
+            length = struct.unpack('<I', header[:3] + b'\x00')[0]
+            self.seq = (header[3] + 1) % 256
+            payload += self.rfile.read(length)
+            if length < 0xffffff:
+                return payload
+
+    def send_ok(self):
+        self.send_packet(b'\x00' + lenenc_int(0) + lenenc_int(0) + struct.pack('<HH', SERVER_STATUS_AUTOCOMMIT, 0))
+
+    def send_eof(self):
+        self.send_packet(b'\xfe' + struct.pack('<HH', 0, SERVER_STATUS_AUTOCOMMIT))
+
+    def send_error(self, code, message):
+        self.send_packet(b'\xff' + struct.pack('<H', code) + b'#42000' + message.encode())
+
+    def send_result(self, columns, rows):
+        self.send_packet(lenenc_int(len(columns)))
+        for name in columns:
+            self.send_packet(b''.join(lenenc_str(s) for s in ('def', '', '', '', name, name)) +
+                             b'\x0c' + struct.pack('<HIBHB', 33, 1024, FIELD_TYPE_VAR_STRING, 0, 0) + b'\x00\x00')
+        self.send_eof()
+        for row in rows:
+            self.send_packet(b''.join(lenenc_str(v) for v in row))
+        self.send_eof()
+
+    def handshake(self):
+        variables = self.server.variables
+        salt = os.urandom(20)
+        self.send_packet(
+            b'\x0a' + variables['version'].encode() + b'\x00' +
+            struct.pack('<I', threading.get_ident() & 0xffffffff) + salt[:8] + b'\x00' +
+            struct.pack('<HBHHB', SERVER_CAPABILITIES & 0xffff, 33, SERVER_STATUS_AUTOCOMMIT,
+                        SERVER_CAPABILITIES >> 16, 21) +
+            b'\x00' * 10 + salt[8:] + b'\x00' + b'mysql_native_password\x00')
+        # 不校验用户名密码，任何账号都允许登录
+        if self.read_packet() is None:
+            return False
+        self.send_ok()
+        return True
+
+    def handle(self):
+        if not self.handshake():
+            return
+        while True:
+            packet = self.read_packet()
+            if not packet or packet[0] == COM_QUIT:
+                return
+            command = packet[0]
+            if command == COM_QUERY:
+                self.handle_query(packet[1:].decode('utf-8', 'replace'))
+            elif command in (COM_PING, COM_INIT_DB, COM_REGISTER_SLAVE):
+                self.send_ok()
+            elif command == COM_BINLOG_DUMP:
+                log_pos, flags, _ = struct.unpack('<IHI', packet[1:11])
+                try:
+                    self.binlog_dump(packet[11:].decode(), log_pos, non_block=bool(flags & 0x01))
+                except (ConnectionResetError, BrokenPipeError):
+                    # 与 MySQL 一样，客户端读到需要的事件后直接断开是正常情况
+                    pass
+                return
+            else:
+                self.send_error(ER_PARSE_ERROR, f"command {command} not supported")
+
+    def handle_query(self, sql):
+        variables = self.server.variables
+        sql = sql.strip().rstrip(';')
+
+        if re.match(r'SET\b', sql, re.I):
+            self.send_ok()
+            return
+
+        m = re.match(r"SHOW\s+(?:GLOBAL\s+|SESSION\s+)?VARIABLES\s+LIKE\s+'([^']+)'", sql, re.I)
+        if m:
+            pattern = re.compile(re.escape(m.group(1).lower()).replace('%', '.*').replace('_', '.') + '$')
+            rows = [(k, v) for k, v in sorted(variables.items()) if pattern.match(k)]
+            self.send_result(('Variable_name', 'Value'), rows)
+            return
+
+        if re.match(r'SHOW\s+(BINARY|MASTER)\s+LOGS$', sql, re.I):
+            rows = [(name, os.path.getsize(self.server.binlog_path(name))) for name in self.server.binlog_files]
+            self.send_result(('Log_name', 'File_size'), rows)
+            return
+
+        if re.match(r'SHOW\s+(MASTER|BINARY\s+LOG)\s+STATUS$', sql, re.I):
+            name = self.server.binlog_files[-1]
+            self.send_result(('File', 'Position', 'Binlog_Do_DB', 'Binlog_Ignore_DB', 'Executed_Gtid_Set'),
+                             [(name, os.path.getsize(self.server.binlog_path(name)), '', '', '')])
+            return
+
+        m = re.match(r'SELECT\s+@@(?:global\.|session\.)?(\w+)$', sql, re.I)
+        if m and m.group(1).lower() in variables:
+            self.send_result((f"@@{m.group(1)}",), [(variables[m.group(1).lower()],)])
+            return
+
+        self.send_error(ER_PARSE_ERROR, f"fake server does not support: {sql}")
+
+    def artificial_event(self, event_type, body):
+        size = EVENT_HEADER_LEN + len(body) + (4 if self.server.use_checksum else 0)
+        event = struct.pack('<IBIIIH', 0, event_type, 1, size, 0, LOG_EVENT_ARTIFICIAL_F) + body
+        if self.server.use_checksum:
+            event += struct.pack('<I', zlib.crc32(event) & 0xffffffff)
+        return event
+
+    def binlog_dump(self, log_file, log_pos, non_block):
+        files = self.server.binlog_files
+        if log_file not in files:
+            self.send_error(1236, f"Could not find first log file name in binary log index file: {log_file}")
+            return
+
+        rate = self.server.rate
+        sent = 0
+        started = time.monotonic()
+
+        for name in files[files.index(log_file):]:
+            path = self.server.binlog_path(name)
+            # 与 MySQL 一样，先发送伪造的 rotate 事件告知当前文件
+            self.send_packet(b'\x00' + self.artificial_event(ROTATE_EVENT, struct.pack('<Q', log_pos) + name.encode()))
+
+            if log_pos > 4:
+                # 从文件中间开始时补发 FDE，log_pos 置 0 以免客户端更新位点
+                _, fde = next(read_events(path))
+                fde = bytearray(fde)
+                fde[13:17] = b'\x00\x00\x00\x00'
+                if self.server.use_checksum:
+                    fde[-4:] = struct.pack('<I', zlib.crc32(fde[:-4]) & 0xffffffff)
+                self.send_packet(b'\x00' + bytes(fde))
+
+            for _, event in read_events(path, log_pos):
+                self.send_packet(b'\x00' + event)
+                sent += 1
+                if rate:
+                    delay = started + sent / rate - time.monotonic()
+                    if delay > 0:
+                        time.sleep(delay)
+            log_pos = 4
+
+        if non_block:
+            self.send_eof()
+        else:
+            # 阻塞模式下等待客户端断开
+            while self.rfile.read(1):
+                pass
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="模拟 MySQL 复制协议，回放本地 binlog 文件。")
+    parser.add_argument("--binlog-dir", dest="binlog_dir", type=str, help="binlog文件所在目录", required=True)
+    parser.add_argument("--host", dest="host", type=str, default="127.0.0.1", help="监听地址，默认127.0.0.1")
+    parser.add_argument("--port", dest="port", type=int, default=3306, help="监听端口，默认3306")
+    parser.add_argument("--rate", dest="rate", type=int, default=0, help="每秒回放的事件数，默认0（不限速）")
+    args = parser.parse_args()
+
+    server = FakeMySQLServer(args.binlog_dir, host=args.host, port=args.port, rate=args.rate)
+    print(f"fake MySQL server listening on {server.server_address[0]}:{server.server_address[1]}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+# 恢复文件的 SQLite 索引：记录每条语句的时间、binlog 位点、表、操作类型、主键值，以及在恢复文件中的字节偏移，
+# 排查时按条件查询索引后直接 seek 读取对应语句，无需对几十 GB 的恢复文件做全量扫描。
+import argparse
+import datetime
+import json
+import os
+import sqlite3
+import sys
+
+from binlog_row import event_primary_key
+
+try:
+    from zoneinfo import ZoneInfo
+    timezone = ZoneInfo('Asia/Shanghai')
+except (ImportError, KeyError):
+    # 与 reverse_sql.py 相同：没有 zoneinfo 或系统缺少时区库时使用固定的东八区
+    timezone = datetime.timezone(datetime.timedelta(hours=8), 'Asia/Shanghai')
+
+BATCH_SIZE = 10000
+
+
+def index_fields(binlogevent, values, operation, log_file):
+    # 生成写入 result_queue 的索引字段，主键值统一转成字符串便于查询比对
+    return {
+        "schema": binlogevent.schema,
+        "table": binlogevent.table,
+        "operation": operation,
+        "log_file": log_file,
+        "log_pos": binlogevent.packet.log_pos,
+        "primary_key": {k: str(values.get(k)) for k in event_primary_key(binlogevent)},
+    }
+
+
+def primary_key_text(primary_key):
+    return json.dumps(primary_key, sort_keys=True, ensure_ascii=False)
+
+
+def parse_event_time(text):
+    # 查询条件中的时间与恢复文件中打印的时间一致，按 Asia/Shanghai 解析
+    return int(datetime.datetime.strptime(text, '%Y-%m-%d %H:%M:%S').replace(tzinfo=timezone).timestamp())
+
+
+def format_event_time(event_time):
+    return datetime.datetime.fromtimestamp(event_time, tz=timezone).strftime('%Y-%m-%d %H:%M:%S')
+
+
+class RecoverIndex:
+
+    def __init__(self, path):
+        if os.path.exists(path):
+            os.remove(path)
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("""
+            CREATE TABLE events (
+                event_time INTEGER,
+                log_file TEXT,
+                log_pos INTEGER,
+                schema_name TEXT,
+                table_name TEXT,
+                operation TEXT,
+                primary_key TEXT,
+                sql_file TEXT,
+                offset INTEGER,
+                length INTEGER
+            )""")
+        self.rows = []
+
+    def add(self, item, sql_file, offset, length):
+        self.rows.append((item["event_time"], item.get("log_file"), item.get("log_pos"), item.get("schema"),
+                          item.get("table"), item.get("operation"), primary_key_text(item.get("primary_key", {})),
+                          os.path.basename(sql_file), offset, length))
+        if len(self.rows) >= BATCH_SIZE:
+            self.flush()
+
+    def flush(self):
+        self.conn.executemany("INSERT INTO events VALUES (?,?,?,?,?,?,?,?,?,?)", self.rows)
+        self.rows = []
+
+    def close(self):
+        self.flush()
+        # 数据全部写入后再建索引，避免逐行维护索引的开销
+        self.conn.execute("CREATE INDEX idx_table_time ON events (table_name, event_time)")
+        self.conn.execute("CREATE INDEX idx_primary_key ON events (primary_key)")
+        self.conn.commit()
+        self.conn.close()
+
+
+def query_index(path, table=None, operation=None, primary_key=None, st=None, et=None, sql_file=None):
+    conditions = []
+    params = []
+    if table:
+        conditions.append("table_name = ?")
+        params.append(table)
+    if operation:
+        conditions.append("operation = ?")
+        params.append(operation.lower())
+    if primary_key:
+        conditions.append("primary_key = ?")
+        params.append(primary_key_text(primary_key))
+    if st:
+        conditions.append("event_time >= ?")
+        params.append(parse_event_time(st))
+    if et:
+        conditions.append("event_time <= ?")
+        params.append(parse_event_time(et))
+    if sql_file:
+        conditions.append("sql_file = ?")
+        params.append(sql_file)
+
+    sql = "SELECT event_time, log_file, log_pos, table_name, operation, primary_key, sql_file, offset, length FROM events"
+    if conditions:
+        sql += " WHERE " + " AND ".join(conditions)
+    sql += " ORDER BY sql_file, offset"
+
+    conn = sqlite3.connect(path)
+    try:
+        return conn.execute(sql, params).fetchall()
+    finally:
+        conn.close()
+
+
+def extract_statements(path, rows):
+    # 按偏移量直接从恢复文件中读取对应语句
+    base_dir = os.path.dirname(os.path.abspath(path))
+    files = {}
+    try:
+        for row in rows:
+            sql_file, offset, length = row[6], row[7], row[8]
+            if sql_file not in files:
+                files[sql_file] = open(os.path.join(base_dir, sql_file), "rb")
+            f = files[sql_file]
+            f.seek(offset)
+            yield f.read(length).decode("utf-8")
+    finally:
+        for f in files.values():
+            f.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="查询恢复文件的SQLite索引，按条件提取语句。", epilog=r"""
+Example usage:
+    shell> python3 recover_index.py --index hcy_t1_recover_2023-07-06_22:00:00.sqlite -t t1 --pk id=123 \
+            --start-time "2023-07-06 14:02:00" --end-time "2023-07-06 14:03:00" """,
+            formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument("--index", dest="index", type=str, help="索引文件（与恢复文件在同一目录）", required=True)
+    parser.add_argument("-t", "--table", dest="table", type=str, help="表名")
+    parser.add_argument("-op", "--operation", dest="operation", type=str, help="原始操作类型（insert/update/delete）")
+    parser.add_argument("--pk", dest="pk", type=str, nargs="+", help="主键值，格式 列名=值，联合主键用空格分隔多个")
+    parser.add_argument("--start-time", dest="st", type=str, help="起始时间（Asia/Shanghai，与恢复文件中的时间一致）")
+    parser.add_argument("--end-time", dest="et", type=str, help="结束时间（Asia/Shanghai，与恢复文件中的时间一致）")
+    parser.add_argument("--file", dest="sql_file", type=str, help="只查询指定的恢复文件（如 _replace.sql）")
+    parser.add_argument("--list", dest="list_only", action="store_true", help="只列出位点信息，不提取语句；位点为事件的结束位置（即下一个事件的起始位置）")
+    args = parser.parse_args()
+
+    primary_key = dict(pk.split("=", 1) for pk in args.pk) if args.pk else None
+    rows = query_index(args.index, table=args.table, operation=args.operation, primary_key=primary_key,
+                       st=args.st, et=args.et, sql_file=args.sql_file)
+
+    if args.list_only:
+        for event_time, log_file, log_pos, table, operation, pk, sql_file, offset, length in rows:
+            print(f"{format_event_time(event_time)}\t{log_file}:{log_pos}\t{table}\t{operation}\t{pk}\t{sql_file}@{offset}")
+    else:
+        for statement in extract_statements(args.index, rows):
+            sys.stdout.write(statement)
+    print(f"-- 共匹配 {len(rows)} 条", file=sys.stderr)
@@ -2,29 +2,58 @@
 import argparse
 import time
 import datetime
-import pytz
 import sys
 import threading
-from concurrent.futures import ThreadPoolExecutor, wait
+from functools import lru_cache
 from queue import Queue
-import pymysql
-from pymysqlreplication import BinLogStreamReader
-from pymysqlreplication.row_event import (
-    WriteRowsEvent,
-    UpdateRowsEvent,
-    DeleteRowsEvent
-)
 
-timezone = pytz.timezone('Asia/Shanghai')
+try:
+    from zoneinfo import ZoneInfo
+    timezone = ZoneInfo('Asia/Shanghai')
+except (ImportError, KeyError):
+    # 没有 zoneinfo（Python 3.9 以下）或系统缺少时区库时，使用固定的东八区，Asia/Shanghai 自 1991 年起已无夏令时
+    timezone = datetime.timezone(datetime.timedelta(hours=8), 'Asia/Shanghai')
+
+# pymysql、pymysqlreplication 导入较慢，由 import_binlog_modules() 在连接数据库前才导入，
+# --help、参数错误等不需要连接数据库的路径可以立即返回
+pymysql = BinLogStreamReader = WriteRowsEvent = UpdateRowsEvent = DeleteRowsEvent = TableMapEvent = None
 
 result_queue = Queue()
 result_queue_replace = Queue()
 combined_array = []
 combined_array_replace = []
 
+# --verify 模式下记录每行变更后的镜像，用于回滚前与线上数据比对；after_image 只在指定 --verify 时由 main() 导入
+verify_queue = Queue()
+collect_after_images = False
+after_image = None
+
+# --index 模式下为每条语句附带表、操作类型、binlog 位点和主键值，写入 SQLite 索引；index_fields 只在指定 --index 时由 main() 导入
+collect_index_fields = False
+index_fields = None
+
 # 创建一个锁对象
 file_lock = threading.Lock()
 
+
+def import_binlog_modules():
+    global pymysql, BinLogStreamReader, WriteRowsEvent, UpdateRowsEvent, DeleteRowsEvent, TableMapEvent
+    import pymysql
+    from pymysqlreplication import BinLogStreamReader
+    from pymysqlreplication.row_event import (
+        WriteRowsEvent,
+        UpdateRowsEvent,
+        DeleteRowsEvent,
+        TableMapEvent
+    )
+
+
+@lru_cache(maxsize=4096)
+def format_event_time(event_time):
+    # 同一秒内的多条变更只做一次时区转换
+    return datetime.datetime.fromtimestamp(event_time, tz=timezone).strftime('%Y-%m-%d %H:%M:%S')
+
+
 def check_binlog_settings(mysql_host=None, mysql_port=None, mysql_user=None,
                           mysql_passwd=None, mysql_database=None, mysql_charset=None):
     # 连接 MySQL 数据库
@@ -37,6 +66,7 @@ def check_binlog_settings(mysql_host=None, mysql_port=None, mysql_user=None,
         "charset": mysql_charset
     }
 
+    import_binlog_modules()
     conn = pymysql.connect(**source_mysql_settings)
     cursor = conn.cursor()
 
@@ -54,19 +84,24 @@ def check_binlog_settings(mysql_host=None, mysql_port=None, mysql_user=None,
         # 检查参数值是否满足条件
         if binlog_format != 'ROW' and binlog_row_image != 'FULL':
             exit("\nMySQL 的变量参数 binlog_format 的值应为 ROW，参数 binlog_row_image 的值应为 FULL\n")
-            
+    except BaseException:
+        conn.close()
+        raise
     finally:
-        # 关闭数据库连接
         cursor.close()
-        conn.close()
+
+    # 检查通过后不关闭连接，交给 main() 复用为第一个 binlog 流的连接，省去一次连接握手
+    return conn
 
 
-def process_binlogevent(binlogevent, start_time, end_time):
+def process_binlogevent(binlogevent, rows, start_time, end_time, log_file=None):
     database_name = binlogevent.schema
     
     if start_time <= binlogevent.timestamp <= end_time:
-        for row in binlogevent.rows:
+        for row_index, row in enumerate(rows):
             event_time = binlogevent.timestamp
+            # 精确的 binlog 顺序：(文件名, 事件位点, 行序号)，同一秒内的多条变更也能保持原始顺序
+            seq = (log_file or '', binlogevent.packet.log_pos, row_index)
 
             if isinstance(binlogevent, WriteRowsEvent):
                 if only_operation and only_operation != 'insert':
@@ -85,7 +120,10 @@ def process_binlogevent(binlogevent, start_time, end_time):
                                 if isinstance(v, (str, datetime.datetime, datetime.date)) else 'NULL' if v is None else str(v))
                                 for k, v in row["values"].items()]))
 
-                    result_queue.put({"event_time": event_time, "sql": sql, "rollback_sql": rollback_sql})
+                    meta = index_fields(binlogevent, row["values"], 'insert', log_file) if collect_index_fields else {}
+                    result_queue.put({"event_time": event_time, "seq": seq, "sql": sql, "rollback_sql": rollback_sql, **meta})
+                    if collect_after_images:
+                        verify_queue.put(after_image(binlogevent, row["values"], seq))
 
             elif isinstance(binlogevent, UpdateRowsEvent):
                 if only_operation and only_operation != 'update':
@@ -151,8 +189,11 @@ def process_binlogevent(binlogevent, start_time, end_time):
                         print("出现异常错误：", e)
                     #print(rollback_replace_sql)
 
-                    result_queue.put({"event_time": event_time, "sql": sql, "rollback_sql": rollback_sql})
-                    result_queue_replace.put({"event_time": event_time, "sql": sql, "rollback_sql": rollback_replace_sql})
+                    meta = index_fields(binlogevent, row["before_values"], 'update', log_file) if collect_index_fields else {}
+                    result_queue.put({"event_time": event_time, "seq": seq, "sql": sql, "rollback_sql": rollback_sql, **meta})
+                    result_queue_replace.put({"event_time": event_time, "seq": seq, "sql": sql, "rollback_sql": rollback_replace_sql, **meta})
+                    if collect_after_images:
+                        verify_queue.put(after_image(binlogevent, row["after_values"], seq))
 
             elif isinstance(binlogevent, DeleteRowsEvent):
                 if only_operation and only_operation != 'delete':
@@ -172,11 +213,24 @@ def process_binlogevent(binlogevent, start_time, end_time):
                         for i in list(row["values"].values())])
                     )
 
-                    result_queue.put({"event_time": event_time, "sql": sql, "rollback_sql": rollback_sql})
+                    meta = index_fields(binlogevent, row["values"], 'delete', log_file) if collect_index_fields else {}
+                    result_queue.put({"event_time": event_time, "seq": seq, "sql": sql, "rollback_sql": rollback_sql, **meta})
+                    if collect_after_images:
+                        verify_queue.put(after_image(binlogevent, row["values"], seq, deleted=True))
 
 
 def main(only_tables=None, only_operation=None, mysql_host=None, mysql_port=None, mysql_user=None, mysql_passwd=None,
-         mysql_database=None, mysql_charset=None, binlog_file=None, binlog_pos=None, st=None, et=None, max_workers=None, print_output=False, replace_output=False):
+         mysql_database=None, mysql_charset=None, binlog_file=None, binlog_pos=None, st=None, et=None, max_workers=None, print_output=False, replace_output=False,
+         cache_dir=None, cache_size=None, verify_output=False, index_output=False,
+         reverse_output=False, summary_output=False, conn=None):
+    global collect_after_images, collect_index_fields, after_image, index_fields
+    collect_after_images = verify_output
+    collect_index_fields = index_output
+    if verify_output:
+        from rollback_verify import after_image
+    if index_output:
+        from recover_index import index_fields
+
     valid_operations = ['insert', 'delete', 'update']
 
     if only_operation:
@@ -198,18 +252,84 @@ def main(only_tables=None, only_operation=None, mysql_host=None, mysql_port=None
     end_time = int(time.mktime(time.strptime(et, '%Y-%m-%d %H:%M:%S')))
 
     interval = (end_time - start_time) // max_workers  # 将时间范围划分为 10 等份
-    executor = ThreadPoolExecutor(max_workers=max_workers)
 
-    stream = BinLogStreamReader(
-        connection_settings=source_mysql_settings,
-        server_id=1234567890,
-        blocking=False,
-        resume_stream=True,
-        only_events=[WriteRowsEvent, UpdateRowsEvent, DeleteRowsEvent],
-        log_file=binlog_file,
-        log_pos=int(binlog_pos),
-        only_tables=only_tables
-    )
+    import_binlog_modules()
+
+    def connect(**settings):
+        # 环境检查传入的连接只复用给第一个 binlog 流（控制连接使用 DictCursor，需要单独建立）
+        nonlocal conn
+        if conn is not None and "cursorclass" not in settings:
+            stream_conn, conn = conn, None
+            return stream_conn
+        return pymysql.connect(**settings)
+
+    # 启用本地缓存时，优先从缓存目录回放 binlog 事件，减少对主库的重复拉取
+    binlog_cache = None
+    if cache_dir:
+        from binlog_cache import BinlogCache, CachedBinLogStreamReader, check_reader_compatibility, get_server_state
+        reason = check_reader_compatibility()
+        if reason:
+            print(f"{reason}，本次运行不使用 binlog 本地缓存")
+        else:
+            server_uuid, binary_logs = get_server_state(source_mysql_settings, conn)
+            binlog_cache = BinlogCache(cache_dir, server_uuid, cache_size * 1024 * 1024, binary_logs,
+                                      source_mysql_settings)
+
+    stream_events = [WriteRowsEvent, UpdateRowsEvent, DeleteRowsEvent]
+    if summary_output:
+        # 统计模式需要 TableMap 事件的位点，给出可直接用于后续解析的起始位置
+        stream_events.append(TableMapEvent)
+
+    def open_stream(log_file, log_pos):
+        stream_settings = dict(
+            connection_settings=source_mysql_settings,
+            server_id=1234567890,
+            blocking=False,
+            resume_stream=True,
+            only_events=stream_events,
+            log_file=log_file,
+            log_pos=int(log_pos),
+            only_tables=only_tables,
+            pymysql_wrapper=connect
+        )
+        if binlog_cache:
+            return CachedBinLogStreamReader(binlog_cache=binlog_cache, **stream_settings)
+        return BinLogStreamReader(**stream_settings)
+
+    if summary_output:
+        # 统计模式：顺序读取一遍 binlog，只计数不生成 SQL。优先直接解析原始事件，遇到不支持的事件或列类型时改用完整解析
+        from binlog_summary import BinlogSummary, SummaryUnsupported, read_raw_events
+        summary = BinlogSummary(timezone, only_operation=only_operation)
+        events = read_raw_events(lambda: connect(**source_mysql_settings), binlog_file, int(binlog_pos), 1234567890,
+                                 binlog_cache)
+        try:
+            summary.add_raw_events(events, start_time, end_time, only_tables)
+        except SummaryUnsupported as e:
+            # 先关闭原始事件的 dump 连接，再以相同的 server_id 重新读取
+            events.close()
+            print(f"{e}，改用完整解析进行统计")
+            summary = BinlogSummary(timezone, only_operation=only_operation)
+            stream = open_stream(binlog_file, binlog_pos)
+            for binlogevent in stream:
+                if binlogevent.timestamp < start_time:
+                    continue
+                elif binlogevent.timestamp > end_time:
+                    break
+                summary.add(binlogevent, stream.log_file)
+            stream.close()
+        finally:
+            events.close()
+        if conn is not None:
+            conn.close()
+
+        formatted_time = datetime.datetime.now().strftime("%Y-%m-%d_%H:%M:%S")
+        summary.report(f"{mysql_database}_summary_{formatted_time}.json", st=st, et=et)
+        return
+
+    stream = open_stream(binlog_file, binlog_pos)
+
+    from concurrent.futures import ThreadPoolExecutor, wait
+    executor = ThreadPoolExecutor(max_workers=max_workers)
 
     next_binlog_file = binlog_file
     next_binlog_pos = binlog_pos
@@ -230,11 +350,16 @@ def main(only_tables=None, only_operation=None, mysql_host=None, mysql_port=None
                 continue
             elif binlogevent.timestamp > task_end_time:  # 如果事件的时间大于任务的结束时间，则结束该任务的迭代
                 break
-            task = executor.submit(process_binlogevent, binlogevent, task_start_time, task_end_time)
+            # 行数据在读取线程中解码后再交给工作线程：TableMapEvent 会先把表结构放入共享的 table_map 再补全列名，
+            # 若由工作线程延迟解码，可能读到下一个 TableMap 尚未补全的列名（UNKNOWN_COL）
+            rows = binlogevent.rows
+            task = executor.submit(process_binlogevent, binlogevent, rows, task_start_time, task_end_time, stream.log_file)
 
             with next_binlog_file_lock:
                 if stream.log_file > next_binlog_file:
                     next_binlog_file = stream.log_file
+                    # 已轮转到新的 binlog 文件，位点需从新文件重新计算
+                    next_binlog_pos = stream.log_pos
 
             with next_binlog_pos_lock:
                 if stream.log_file == next_binlog_file and stream.log_pos > next_binlog_pos:
@@ -252,16 +377,7 @@ def main(only_tables=None, only_operation=None, mysql_host=None, mysql_port=None
 
         stream.close()
 
-        stream = BinLogStreamReader(
-            connection_settings=source_mysql_settings,
-            server_id=1234567890,
-            blocking=False,
-            resume_stream=True,
-            only_events=[WriteRowsEvent, UpdateRowsEvent, DeleteRowsEvent],
-            log_file=next_binlog_file,
-            log_pos=int(next_binlog_pos),
-            only_tables=only_tables
-        )
+        stream = open_stream(next_binlog_file, next_binlog_pos)
 
     while not result_queue.empty():
         combined_array.append(result_queue.get())
@@ -269,16 +385,22 @@ def main(only_tables=None, only_operation=None, mysql_host=None, mysql_port=None
     while not result_queue_replace.empty():
         combined_array_replace.append(result_queue_replace.get())
 
-    sorted_array = sorted(combined_array, key=lambda x: x["event_time"])
-    sorted_array_replace = sorted(combined_array_replace, key=lambda x: x["event_time"])
+    # 按 binlog 顺序排序，--reverse 时从最新的变更开始输出，回滚语句可直接按文件顺序执行
+    sorted_array = sorted(combined_array, key=lambda x: x["seq"], reverse=reverse_output)
+    sorted_array_replace = sorted(combined_array_replace, key=lambda x: x["seq"], reverse=reverse_output)
 
     c_time = datetime.datetime.now()
     formatted_time = c_time.strftime("%Y-%m-%d_%H:%M:%S")
 
+    # 与恢复文件同目录生成 SQLite 索引，记录每条语句在文件中的偏移量；没有可写入的语句时不生成索引
+    recover_index = None
+    if index_output and sorted_array:
+        from recover_index import RecoverIndex
+        recover_index = RecoverIndex(f"{binlogevent.schema}_{binlogevent.table}_recover_{formatted_time}.sqlite")
+
     for item in sorted_array:
         event_time = item["event_time"]
-        dt = datetime.datetime.fromtimestamp(event_time, tz=timezone)
-        current_time = dt.strftime('%Y-%m-%d %H:%M:%S')
+        current_time = format_event_time(event_time)
 
         sql = item["sql"]
         rollback_sql = item["rollback_sql"]
@@ -291,18 +413,19 @@ def main(only_tables=None, only_operation=None, mysql_host=None, mysql_port=None
         #filename = f"{binlogevent.schema}_{binlogevent.table}_recover.sql"
         with file_lock:  # 获取文件锁
             with open(filename, "a", encoding="utf-8") as file:
-    
+                offset = file.tell()
                 file.write(f"-- SQL执行时间:{current_time}\n")
                 file.write(f"-- 原生sql:\n \t-- {sql}\n")
                 file.write(f"-- 回滚sql:\n \t{rollback_sql}\n")
                 file.write("-- ----------------------------------------------------------\n")
+                if recover_index:
+                    recover_index.add(item, filename, offset, file.tell() - offset)
 
     if replace_output:
         # update 转换为 replace
         for item in sorted_array_replace:
             event_time = item["event_time"]
-            dt = datetime.datetime.fromtimestamp(event_time, tz=timezone)
-            current_time = dt.strftime('%Y-%m-%d %H:%M:%S')
+            current_time = format_event_time(event_time)
     
             sql = item["sql"]
             rollback_sql = item["rollback_sql"]
@@ -316,12 +439,36 @@ def main(only_tables=None, only_operation=None, mysql_host=None, mysql_port=None
             # filename = f"{binlogevent.schema}_{binlogevent.table}_recover.sql"
             with file_lock:  # 获取文件锁
                 with open(filename, "a", encoding="utf-8") as file:
+                    offset = file.tell()
                     file.write(f"-- SQL执行时间:{current_time}\n")
                     file.write(f"-- 原生sql:\n \t-- {sql}\n")
                     file.write(f"-- 回滚sql:\n \t{rollback_sql}\n")
                     file.write("-- ----------------------------------------------------------\n")
+                    if recover_index:
+                        recover_index.add(item, filename, offset, file.tell() - offset)
+
+    if recover_index:
+        recover_index.close()
+
+    if verify_output:
+        # 回滚前冲突检查：按主键批量查询线上表，比对每行最后一次变更后的镜像
+        images = []
+        while not verify_queue.empty():
+            images.append(verify_queue.get())
+        if images:
+            from rollback_verify import verify_after_images, write_verify_report
+            results = verify_after_images(source_mysql_settings, images, max_workers=max_workers)
+            # 报告文件名与恢复文件一致，取 binlog 中最后一条变更所在的表
+            last_image = max(images, key=lambda x: x["position"])
+            write_verify_report(results, f"{last_image['schema']}_{last_image['table']}_verify_{formatted_time}.txt",
+                                print_output=print_output)
+        else:
+            print("没有匹配的行变更，跳过冲突检查")
 
     stream.close()
+    if conn is not None:
+        # 全部从本地缓存回放时，传入的连接没有被使用
+        conn.close()
     executor.shutdown()
 
 
@@ -346,6 +493,12 @@ Example usage:
     parser.add_argument("--max-workers", dest="max_workers", type=int, default=4, help="线程数，默认4（并发越高，锁的开销就越大，适当调整并发数）")
     parser.add_argument("--print", dest="print_output", action="store_true", help="将解析后的SQL输出到终端")
     parser.add_argument("--replace", dest="replace_output", action="store_true", help="将update转换为replace操作")
+    parser.add_argument("--reverse", dest="reverse_output", action="store_true", help="按binlog顺序倒序输出（最新的变更在前），回滚时可直接按文件顺序执行")
+    parser.add_argument("--summary", dest="summary_output", action="store_true", help="快速统计模式：不生成SQL，按表/操作/分钟汇总行数和起止binlog位点，输出到终端和JSON文件")
+    parser.add_argument("--verify", dest="verify_output", action="store_true", help="回滚前冲突检查：按主键批量比对线上表当前数据，报告一致/已变化/不存在的行")
+    parser.add_argument("--index", dest="index_output", action="store_true", help="为恢复文件生成SQLite索引（按时间/位点/表/操作/主键查询并定位语句）")
+    parser.add_argument("--cache-dir", dest="cache_dir", type=str, help="binlog本地缓存目录，重复排查同一区间时从本地读取，减轻主库压力")
+    parser.add_argument("--cache-size", dest="cache_size", type=int, default=10240, help="binlog本地缓存上限(MB)，超出后按LRU淘汰，默认10240")
     args = parser.parse_args()
 
     if args.only_tables:
@@ -358,8 +511,8 @@ Example usage:
     else:
         only_operation = None
 
-    # 环境检查
-    check_binlog_settings(
+    # 环境检查，检查用的连接会继续用于读取 binlog
+    conn = check_binlog_settings(
         mysql_host=args.mysql_host,
         mysql_port=args.mysql_port,
         mysql_user=args.mysql_user,
@@ -383,7 +536,14 @@ Example usage:
         et=args.et,
         max_workers=args.max_workers,
         print_output=args.print_output,
-        replace_output=args.replace_output
+        replace_output=args.replace_output,
+        cache_dir=args.cache_dir,
+        cache_size=args.cache_size,
+        verify_output=args.verify_output,
+        index_output=args.index_output,
+        reverse_output=args.reverse_output,
+        summary_output=args.summary_output,
+        conn=conn
     )
 
 
@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+# 执行回滚前的冲突检查：把 binlog 中每一行最后一次变更后的镜像，按主键分批（WHERE pk IN (...)）
+# 与线上表的当前数据比对，报告仍一致、已被再次修改、已不存在的行。
+import json
+import struct
+from concurrent.futures import ThreadPoolExecutor
+from queue import LifoQueue
+
+import pymysql
+from pymysql.cursors import DictCursor
+from pymysqlreplication.constants import FIELD_TYPE
+
+from binlog_row import event_primary_key
+
+
+def after_image(binlogevent, values, seq, deleted=False):
+    # deleted=True 表示该行已被删除，回滚前线上应当不存在该行；
+    # seq 为 (文件名, 事件位点, 行序号)，log_pos 在每个 binlog 文件中都从头开始，必须带上文件名才能确定先后
+    primary_key = event_primary_key(binlogevent)
+
+    return {
+        "schema": binlogevent.schema,
+        "table": binlogevent.table,
+        "primary_key": primary_key,
+        "key": tuple(values.get(k) for k in primary_key),
+        "values": None if deleted else values,
+        "position": seq,
+        # FLOAT、SET、BIT 列在 binlog 与线上查询结果中的表示不同，比对时需要特殊处理
+        "column_types": {name: column.type for name, column in zip(values, binlogevent.columns)
+                         if column.type in (FIELD_TYPE.FLOAT, FIELD_TYPE.SET, FIELD_TYPE.BIT)},
+    }
+
+
+def _normalize(v):
+    if isinstance(v, bytes):
+        return v.decode('utf-8', 'replace')
+    return str(v)
+
+
+def _same_value(expected, current, column_type=None):
+    if column_type == FIELD_TYPE.SET:
+        # binlog 中解析为集合（空集合解析为 None），线上查询返回逗号分隔的字符串
+        if isinstance(current, bytes):
+            current = current.decode('utf-8', 'replace')
+        current = set(current.split(',')) - {''} if isinstance(current, str) else current
+        return set(expected or ()) == set(current or ())
+    if column_type == FIELD_TYPE.BIT and isinstance(expected, str) and isinstance(current, bytes):
+        # binlog 中解析为 '101' 形式的位串，线上查询返回大端字节串
+        try:
+            return int(expected, 2) == int.from_bytes(current, 'big')
+        except ValueError:
+            return False
+    if expected == current:
+        return True
+    if column_type == FIELD_TYPE.FLOAT and isinstance(expected, float) and current is not None:
+        # binlog 中是单精度值，线上查询返回的是按显示精度舍入后的值，按单精度比较
+        try:
+            return expected == struct.unpack('<f', struct.pack('<f', float(current)))[0]
+        except (TypeError, ValueError, OverflowError):
+            return False
+    if isinstance(expected, (dict, list)) and isinstance(current, (str, bytes)):
+        try:
+            return json.loads(current) == expected
+        except ValueError:
+            return False
+    return expected is not None and current is not None and _normalize(expected) == _normalize(current)
+
+
+def _fetch_rows(pool, schema, table, primary_key, keys):
+    placeholder = ','.join(['%s'] * len(primary_key))
+    if len(primary_key) == 1:
+        where = f"`{primary_key[0]}` IN ({','.join(['%s'] * len(keys))})"
+    else:
+        columns = ','.join(f"`{k}`" for k in primary_key)
+        where = f"({columns}) IN ({','.join([f'({placeholder})'] * len(keys))})"
+    params = [v for key in keys for v in key]
+
+    conn = pool.get()
+    try:
+        with conn.cursor(DictCursor) as cursor:
+            cursor.execute(f"SELECT * FROM `{schema}`.`{table}` WHERE {where}", params)
+            rows = cursor.fetchall()
+    finally:
+        pool.put(conn)
+
+    return {tuple(_normalize(row[k]) for k in primary_key): row for row in rows}
+
+
+def verify_after_images(connection_settings, images, max_workers=4, chunk_size=1000):
+    # 同一行只保留最后一次变更后的镜像（按 binlog 中的先后顺序）
+    latest = {}
+    skipped = {}
+    for image in sorted(images, key=lambda x: x["position"]):
+        table_key = (image["schema"], image["table"])
+        if not image["primary_key"]:
+            skipped[table_key] = skipped.get(table_key, 0) + 1
+            continue
+        latest.setdefault((table_key, image["primary_key"]), {})[tuple(_normalize(v) for v in image["key"])] = image
+
+    chunks = []
+    for ((schema, table), primary_key), table_images in latest.items():
+        keys = list(table_images)
+        for i in range(0, len(keys), chunk_size):
+            chunk = [table_images[k] for k in keys[i:i + chunk_size]]
+            chunks.append((schema, table, primary_key, chunk))
+
+    results = {}
+    for table_key, count in skipped.items():
+        results.setdefault(table_key, {"match": 0, "drifted": [], "missing": [], "skipped": 0})["skipped"] = count
+    if not chunks:
+        return results
+
+    # 连接池：每个线程从池中取一个连接，批量查询后归还。
+    # binlog 中的 TIMESTAMP 列按 UTC 解析（不带时区），会话时区设为 UTC 后线上查询结果才能直接比对
+    pool = LifoQueue()
+    connections = [pymysql.connect(init_command="SET time_zone='+00:00'", **connection_settings)
+                   for _ in range(min(max_workers, len(chunks)))]
+    for conn in connections:
+        pool.put(conn)
+
+    def check_chunk(schema, table, primary_key, chunk):
+        rows = _fetch_rows(pool, schema, table, primary_key, [image["key"] for image in chunk])
+        match, drifted, missing = 0, [], []
+        for image in chunk:
+            current = rows.get(tuple(_normalize(v) for v in image["key"]))
+            expected = image["values"]
+            if expected is None:
+                # 已删除的行：线上仍不存在才可以安全回滚（重新插入）
+                if current is None:
+                    match += 1
+                else:
+                    drifted.append((image["key"], [(k, None, v) for k, v in current.items()]))
+            elif current is None:
+                missing.append(image["key"])
+            else:
+                column_types = image["column_types"]
+                diffs = [(k, v, current.get(k)) for k, v in expected.items()
+                         if k in current and not _same_value(v, current[k], column_types.get(k))]
+                if diffs:
+                    drifted.append((image["key"], diffs))
+                else:
+                    match += 1
+        return (schema, table), primary_key, match, drifted, missing
+
+    try:
+        with ThreadPoolExecutor(max_workers=len(connections)) as executor:
+            futures = [executor.submit(check_chunk, *chunk) for chunk in chunks]
+            for future in futures:
+                table_key, primary_key, match, drifted, missing = future.result()
+                result = results.setdefault(table_key, {"match": 0, "drifted": [], "missing": [], "skipped": 0})
+                result["primary_key"] = primary_key
+                result["match"] += match
+                result["drifted"].extend(drifted)
+                result["missing"].extend(missing)
+    finally:
+        for conn in connections:
+            conn.close()
+
+    return results
+
+
+def write_verify_report(results, filename, print_output=False):
+    lines = []
+    for (schema, table), result in sorted(results.items()):
+        primary_key = result.get("primary_key", ())
+        lines.append(f"-- 表:`{schema}`.`{table}` 一致:{result['match']} 已变化:{len(result['drifted'])} "
+                     f"不存在:{len(result['missing'])} 无主键跳过:{result['skipped']}\n")
+
+        for key, diffs in result["drifted"]:
+            where = ' AND '.join(f"`{k}`={v!r}" for k, v in zip(primary_key, key))
+            lines.append(f"-- 已变化 {where}\n")
+            for column, expected, current in diffs:
+                lines.append(f" \t-- `{column}`: binlog={expected!r} 当前={current!r}\n")
+
+        for key in result["missing"]:
+            where = ' AND '.join(f"`{k}`={v!r}" for k, v in zip(primary_key, key))
+            lines.append(f"-- 不存在 {where}\n")
+        lines.append("-- ----------------------------------------------------------\n")
+
+    with open(filename, "w", encoding="utf-8") as file:
+        file.writelines(lines)
+
+    for (schema, table), result in sorted(results.items()):
+        print(f"`{schema}`.`{table}` 一致:{result['match']} 已变化:{len(result['drifted'])} "
+              f"不存在:{len(result['missing'])} 无主键跳过:{result['skipped']}")
+    if print_output:
+        print(''.join(lines))
+    print(f"冲突检查报告已写入 {filename}")